@@ -0,0 +1,182 @@
+"""Нагрузочный тест: перебор кодов с множества аккаунтов на фоне обычных пользователей.
+
+Моделирует обработку обновлений с ограниченным числом обработчиков (UPDATE_CONCURRENCY)
+и задержкой ответа Telegram и сравнивает задержку поиска у обычных пользователей
+без защиты и с защищённым режимом (load_shedding.LoadShedder). Защищённый режим
+проверяется с историей пользователей в памяти, после перезапуска (история только в БД)
+и для пользователей без истории.
+
+Запуск из корня проекта:
+    python benchmarks/bench_attack.py                 # 1000 запросов/с атаки, 20 с
+    python benchmarks/bench_attack.py 3000 30
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dp_manager  # noqa: E402
+import load_shedding  # noqa: E402
+from utils import ModerationSystem  # noqa: E402
+from codes import CODE_SPACE_SIZE, format_code, validate_code  # noqa: E402
+from config import UPDATE_CONCURRENCY  # noqa: E402
+
+CONTACTS = 2_000  # Существующих кодов в базе
+LEGIT_USERS = 200  # Обычных пользователей
+LEGIT_RPS = 20  # Поисков обычных пользователей в секунду
+SEND_LATENCY = 0.05  # Время ответа Telegram на отправку сообщения, сек
+# Атака заканчивается раньше теста, чтобы было видно возвращение в обычный режим
+ATTACK_SHARE = 0.75
+
+
+def build_database(path: str) -> list:
+    """Создаёт таблицу users со случайными кодами и возвращает эти коды."""
+    codes = [format_code(n) for n in random.sample(range(CODE_SPACE_SIZE), min(CONTACTS, CODE_SPACE_SIZE))]
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE users (
+                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE,
+                contact_text TEXT,
+                chat_id INTEGER,
+                img TEXT,
+                contact_body TEXT,
+                contact_payload TEXT
+            )
+        ''')
+        conn.executemany(
+            "INSERT INTO users (code, contact_text, chat_id) VALUES (?, ?, ?)",
+            ((code, str(i), 1) for i, code in enumerate(codes))
+        )
+        conn.commit()
+    return codes
+
+
+class Simulation:
+    """Повторяет логику process_code_input без Telegram: проверки, поиск, ответ."""
+
+    def __init__(self, shedder: load_shedding.LoadShedder):
+        self.shedder = shedder
+        self.moderation = ModerationSystem()
+        self.workers = asyncio.Semaphore(UPDATE_CONCURRENCY)
+        self.latencies = []  # Задержки обычных пользователей, сек
+        self.handled = 0
+        self.shed = 0
+        self.legit_shed = 0  # Отсечено запросов обычных пользователей
+
+    async def handle(self, user_id: int, text: str, legit: bool) -> None:
+        started = time.perf_counter()
+        async with self.workers:
+            shed = not self.moderation.is_muted(user_id) and await self._lookup(user_id, text)
+        if legit:
+            self.latencies.append(time.perf_counter() - started)
+            self.legit_shed += shed
+
+    async def _lookup(self, user_id: int, text: str) -> bool:
+        """Возвращает True, если запрос отсечён защитой."""
+        verdict, _ = self.shedder.admit(user_id)
+        if verdict == load_shedding.REJECT:
+            self.shed += 1
+            return True
+        if verdict == load_shedding.DELAY:
+            self.shed += 1
+            await asyncio.sleep(SEND_LATENCY)
+            return True
+
+        self.handled += 1
+        code = text
+        hit = validate_code(code) and dp_manager.get_contacts_by_code(code) is not None
+        self.shedder.record(user_id, code, hit=hit)
+        if not hit:
+            should_mute, _ = self.moderation.increment_attempts(user_id)
+            if should_mute:
+                self.moderation.mute_user(user_id)
+        # Ответ пользователю: контакт или сообщение об ошибке
+        await asyncio.sleep(SEND_LATENCY)
+        return False
+
+
+async def generate(sim: Simulation, codes: list, attack_rps: int, duration: float) -> None:
+    """Подаёт запросы с заданной частотой, не дожидаясь их обработки (как getUpdates)."""
+    tasks = []
+    next_attacker = 10_000_000
+    tick = 0.01
+    started = time.perf_counter()
+    attack_until = started + duration * ATTACK_SHARE
+    legit_budget = attack_budget = 0.0
+    while (now := time.perf_counter()) - started < duration:
+        legit_budget += LEGIT_RPS * tick
+        if now < attack_until:
+            attack_budget += attack_rps * tick
+        while legit_budget >= 1:
+            legit_budget -= 1
+            user_id = random.randrange(LEGIT_USERS)
+            tasks.append(asyncio.create_task(sim.handle(user_id, random.choice(codes), legit=True)))
+        while attack_budget >= 1:
+            attack_budget -= 1
+            # Каждый аккаунт атакующего делает меньше попыток, чем нужно для мута
+            next_attacker += random.random() < 0.25
+            code = format_code(random.randrange(CODE_SPACE_SIZE))
+            tasks.append(asyncio.create_task(sim.handle(next_attacker, code, legit=False)))
+        await asyncio.sleep(tick)
+    await asyncio.gather(*tasks)
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] * 1000
+
+
+async def run(name: str, codes: list, attack_rps: int, duration: float, enabled: bool, history: str) -> None:
+    """Прогоняет сценарий; history — откуда защита знает обычных пользователей.
+
+    "memory" — они находили коды в этом процессе, "database" — до перезапуска (история только в БД),
+    None — истории нет.
+    """
+    shedder = load_shedding.LoadShedder(enabled=enabled)
+    if history is not None:
+        # Обычные пользователи уже успешно находили коды до атаки
+        previous = shedder if history == "memory" else load_shedding.LoadShedder(enabled=enabled)
+        for user_id in range(LEGIT_USERS):
+            previous.record(user_id, random.choice(codes), hit=True)
+        if history == "database":
+            await previous.flush()
+    sim = Simulation(shedder)
+    await generate(sim, codes, attack_rps, duration)
+    print(
+        f"  {name:<28} p50={percentile(sim.latencies, 0.5):.1f} мс "
+        f"p95={percentile(sim.latencies, 0.95):.1f} мс p99={percentile(sim.latencies, 0.99):.1f} мс "
+        f"max={percentile(sim.latencies, 1):.1f} мс | обработано {sim.handled}, отсечено {sim.shed} "
+        f"(обычных {sim.legit_shed})"
+    )
+
+
+def main() -> None:
+    attack_rps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "attack.sqlite3")
+        codes = build_database(path)
+        dp_manager.DATABASE_PATH = path
+        dp_manager.invalidate_lookup_cache()
+        dp_manager.create_user_activity_table()
+
+        print(
+            f"Атака {attack_rps} запросов/с в течение {duration * ATTACK_SHARE:.0f} с, "
+            f"{LEGIT_RPS} запросов/с обычных пользователей, обработчиков: {UPDATE_CONCURRENCY}"
+        )
+        print("Задержка ответа обычным пользователям:")
+        asyncio.run(run("без защиты", codes, attack_rps, duration, enabled=False, history="memory"))
+        asyncio.run(run("с защитой", codes, attack_rps, duration, enabled=True, history="memory"))
+        # Без истории запускается до сценария с перезапуском: только он сохраняет историю в БД
+        asyncio.run(run("с защитой, без истории", codes, attack_rps, duration, enabled=True, history=None))
+        asyncio.run(run("с защитой, после перезапуска", codes, attack_rps, duration, enabled=True, history="database"))
+
+
+if __name__ == "__main__":
+    main()
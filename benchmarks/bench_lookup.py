@@ -0,0 +1,103 @@
+"""Бенчмарк поиска контактов по коду на 10k, 1M и 10M записей.
+
+Запуск из корня проекта:
+    python benchmarks/bench_lookup.py            # 10k, 1M, 10M
+    python benchmarks/bench_lookup.py 10000 1000000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+# Для миллионов записей нужно пространство больше 10 000 кодов
+os.environ.setdefault("CODE_LENGTH", "8")
+os.environ.setdefault("CODE_ALPHABET", "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dp_manager  # noqa: E402
+from codes import CODE_SPACE_SIZE, format_code  # noqa: E402
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+LOOKUPS = 20_000
+INSERT_BATCH = 100_000
+
+
+def build_database(path: str, rows: int) -> list:
+    """Создаёт таблицу users с заданным числом случайных кодов и возвращает эти коды."""
+    codes = [format_code(n) for n in random.sample(range(CODE_SPACE_SIZE), rows)]
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute('''
+            CREATE TABLE users (
+                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE,
+                contact_text TEXT,
+                chat_id INTEGER,
+                img TEXT,
+                contact_body TEXT,
+                contact_payload TEXT
+            )
+        ''')
+        for start in range(0, rows, INSERT_BATCH):
+            conn.executemany(
+                "INSERT INTO users (code, contact_text, chat_id) VALUES (?, ?, ?)",
+                ((code, str(start + i), 1) for i, code in enumerate(codes[start:start + INSERT_BATCH]))
+            )
+        conn.commit()
+    return codes
+
+
+def measure(codes: list) -> dict:
+    """Замеряет задержку get_contacts_by_code в микросекундах."""
+    timings = []
+    for code in codes:
+        started = time.perf_counter()
+        dp_manager.get_contacts_by_code(code)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    timings.sort()
+    return {
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95)],
+        "p99": timings[int(len(timings) * 0.99)],
+    }
+
+
+def run(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        started = time.perf_counter()
+        codes = build_database(path, rows)
+        build_time = time.perf_counter() - started
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        dp_manager.DATABASE_PATH = path
+        dp_manager.invalidate_lookup_cache()
+
+        existing = set(codes)
+        hits = random.sample(codes, min(LOOKUPS, rows))
+        misses = []
+        while len(misses) < LOOKUPS:
+            code = format_code(random.randrange(CODE_SPACE_SIZE))
+            if code not in existing:
+                misses.append(code)
+        hot = [random.choice(hits[:100]) for _ in range(LOOKUPS)]
+
+        results = {
+            "холодные попадания": measure(hits),
+            "промахи": measure(misses),
+            "горячие коды": measure(hot),
+        }
+
+        print(f"\n{rows:,} записей: построение {build_time:.1f} с, размер БД {size_mb:.1f} МБ")
+        for name, stats in results.items():
+            print(f"  {name:<20} p50={stats['p50']:.1f} мкс p95={stats['p95']:.1f} мкс p99={stats['p99']:.1f} мкс")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
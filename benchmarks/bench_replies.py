@@ -0,0 +1,44 @@
+"""Микробенчмарк стоимости построения клавиатур для ответов.
+
+Сравнивает создание разметки при каждом ответе (как было раньше) с общими экземплярами из реестра.
+
+Запуск из корня проекта:
+    python benchmarks/bench_replies.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from keyboards import keyboards  # noqa: E402
+
+NUMBER = 20_000
+
+CASES = {
+    "get_start_keyboard (админ)": lambda build: build("admin"),
+    "get_start_keyboard (пользователь)": lambda build: build(None),
+    "get_inline_back_button": lambda build: build(),
+    "get_moderation_actions_keyboard": lambda build: build(),
+    "get_help_keyboard": lambda build: build(),
+}
+
+
+def uncached(name: str):
+    """Возвращает функцию, которая строит разметку заново при каждом вызове."""
+    return getattr(keyboards, name).__wrapped__
+
+
+def main() -> None:
+    print(f"{'функция':<36}{'построение, мкс':>18}{'реестр, мкс':>14}")
+    for label, call in CASES.items():
+        name = label.split(" ")[0]
+        fresh = uncached(name)
+        shared = getattr(keyboards, name)
+        fresh_time = timeit.timeit(lambda: call(fresh), number=NUMBER) / NUMBER * 1_000_000
+        shared_time = timeit.timeit(lambda: call(shared), number=NUMBER) / NUMBER * 1_000_000
+        print(f"{label:<36}{fresh_time:>18.2f}{shared_time:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import time
+import logging
+import sqlite3
+
+from config import ACL_RELOAD_INTERVAL
+from dp_manager import (
+    get_acl_version, get_acl_entries, set_user_role, remove_user_role, get_database_path
+)
+
+# Роли пользователей
+ROLE_ADMIN = "admin"
+ROLE_MODERATOR = "moderator"
+ROLES = (ROLE_ADMIN, ROLE_MODERATOR)
+
+# Роли с доступом к панели модерации
+STAFF_ROLES = (ROLE_ADMIN, ROLE_MODERATOR)
+
+
+class AccessControl:
+    """Кэш таблицы ролей в памяти: множества ID по ролям, перечитываются при изменении acl."""
+
+    def __init__(self, reload_interval: float = ACL_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._roles = {}  # database_path: {role: set(user_id)}
+        self._versions = {}  # database_path: версия acl, по которой построен кэш
+        self._checked_at = {}  # database_path: время последней проверки версии (monotonic)
+
+    def _load(self, database_path: str) -> None:
+        roles = {role: set() for role in ROLES}
+        for user_id, role, _, _ in get_acl_entries():
+            roles.setdefault(role, set()).add(user_id)
+        self._roles[database_path] = roles
+
+    def _refresh(self) -> dict:
+        """Возвращает роли текущей базы, перечитывая таблицу, если её версия изменилась."""
+        database_path = get_database_path()
+        now = time.monotonic()
+        roles = self._roles.get(database_path)
+        if roles is not None and now - self._checked_at[database_path] < self.reload_interval:
+            return roles
+
+        self._checked_at[database_path] = now
+        try:
+            version = get_acl_version()
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при проверке версии таблицы ролей: {e}")
+            return roles or {role: set() for role in ROLES}
+        if roles is None or version != self._versions.get(database_path):
+            self._load(database_path)
+            self._versions[database_path] = version
+        return self._roles[database_path]
+
+    def invalidate(self) -> None:
+        """Заставляет перечитать роли текущей базы при следующем обращении."""
+        self._roles.pop(get_database_path(), None)
+
+    def get_role(self, user_id: int):
+        """Возвращает роль пользователя или None для обычных пользователей."""
+        roles = self._refresh()
+        if user_id in roles[ROLE_ADMIN]:
+            return ROLE_ADMIN
+        if user_id in roles[ROLE_MODERATOR]:
+            return ROLE_MODERATOR
+        return None
+
+    def list_entries(self) -> list:
+        """Возвращает все записи таблицы ролей текущей базы."""
+        return get_acl_entries()
+
+    def grant(self, user_id: int, role: str, granted_by: int, idempotency_key: str = None) -> str:
+        result = set_user_role(user_id, role, granted_by, idempotency_key)
+        self.invalidate()
+        return result
+
+    def revoke(self, user_id: int, idempotency_key: str = None) -> str:
+        result = remove_user_role(user_id, idempotency_key)
+        self.invalidate()
+        return result
+
+
+# Глобальный экземпляр
+access_control = AccessControl()
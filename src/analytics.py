@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from config import ANALYTICS_FLUSH_INTERVAL, ALL_DATABASE_PATHS
+from dp_manager import (
+    create_analytics_tables, flush_lookup_stats, get_top_codes, get_hourly_totals,
+    get_database_path, using_database
+)
+
+# Формат ключа почасовой статистики
+HOUR_FORMAT = "%Y-%m-%d %H:00"
+
+
+class LookupAnalytics:
+    """Накопление статистики поиска кодов в памяти с периодическим сбросом в SQLite."""
+
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.code_counts = defaultdict(lambda: [0, 0])  # (database_path, code): [hits, misses]
+        self.hour_counts = defaultdict(lambda: [0, 0])  # (database_path, hour): [hits, misses]
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, code: str, hit: bool) -> None:
+        """Учитывает один поиск; только операции в памяти, без обращения к диску."""
+        index = 0 if hit else 1
+        database_path = get_database_path()
+        self.code_counts[(database_path, code)][index] += 1
+        self.hour_counts[(database_path, datetime.now().strftime(HOUR_FORMAT))][index] += 1
+
+    def _merge_back(self, code_counts: dict, hour_counts: dict) -> None:
+        """Возвращает несохранённые счётчики в память, чтобы не потерять их."""
+        for key, (hits, misses) in code_counts.items():
+            self.code_counts[key][0] += hits
+            self.code_counts[key][1] += misses
+        for key, (hits, misses) in hour_counts.items():
+            self.hour_counts[key][0] += hits
+            self.hour_counts[key][1] += misses
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные счётчики в БД одной пачкой."""
+        async with self._flush_lock:
+            if not self.code_counts and not self.hour_counts:
+                return
+            # Подменяем словари целиком, новые поиски копятся уже в свежих
+            code_counts, self.code_counts = self.code_counts, defaultdict(lambda: [0, 0])
+            hour_counts, self.hour_counts = self.hour_counts, defaultdict(lambda: [0, 0])
+            # Группируем счётчики по базам контактов
+            rows = defaultdict(lambda: ([], []))
+            for (database_path, code), (hits, misses) in code_counts.items():
+                rows[database_path][0].append((code, hits, misses))
+            for (database_path, hour), (hits, misses) in hour_counts.items():
+                rows[database_path][1].append((hour, hits, misses))
+            for database_path, (code_rows, hour_rows) in rows.items():
+                try:
+                    with using_database(database_path):
+                        await asyncio.to_thread(flush_lookup_stats, code_rows, hour_rows)
+                except Exception as e:
+                    logging.error(f"Ошибка при сохранении статистики поиска: {e}")
+                    self._merge_back(
+                        {key: value for key, value in code_counts.items() if key[0] == database_path},
+                        {key: value for key, value in hour_counts.items() if key[0] == database_path}
+                    )
+
+    async def report(self, limit: int = 10, hours: int = 24) -> str:
+        """Формирует отчёт: популярные коды и доля промахов за последние часы."""
+        await self.flush()
+        since_hour = (datetime.now() - timedelta(hours=hours)).strftime(HOUR_FORMAT)
+        top_codes, (hits, misses) = await asyncio.gather(
+            asyncio.to_thread(get_top_codes, limit),
+            asyncio.to_thread(get_hourly_totals, since_hour)
+        )
+
+        total = hits + misses
+        miss_rate = misses / total * 100 if total else 0.0
+        text = (
+            f"📈 Статистика поиска за {hours} ч.\n"
+            f"Всего запросов: {total}, найдено: {hits}, не найдено: {misses} ({miss_rate:.1f}%)\n\n"
+        )
+        if not top_codes:
+            return text + "Популярных кодов пока нет."
+        text += "🔝 Популярные коды:\n"
+        for code, code_hits, code_misses in top_codes:
+            text += f"🔹 {code}: найдено {code_hits}, не найдено {code_misses}\n"
+        return text
+
+    async def run(self) -> None:
+        """Периодически сбрасывает статистику в БД."""
+        for database_path in ALL_DATABASE_PATHS:
+            with using_database(database_path):
+                await asyncio.to_thread(create_analytics_tables)
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            # Сохраняем остаток при остановке
+            await self.flush()
+
+
+# Создаем глобальный экземпляр статистики поиска
+lookup_analytics = LookupAnalytics()
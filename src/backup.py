@@ -0,0 +1,169 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime
+
+from config import (
+    DATABASE_PATH, ALL_DATABASE_PATHS, BACKUP_PATH, BACKUP_INTERVAL, BACKUP_RETENTION,
+    BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP
+)
+from metrics import metrics
+from dp_manager import invalidate_lookup_cache, using_database, get_database_path
+from acl import access_control
+
+# Префикс и расширение файлов снимков
+SNAPSHOT_PREFIX = "data-"
+SNAPSHOT_SUFFIX = ".sqlite3"
+
+
+class DatabaseBackup:
+    """Онлайн-резервное копирование базы контактов через инкрементальный backup API SQLite."""
+
+    def __init__(self, database_path: str = DATABASE_PATH, backup_dir: str = BACKUP_PATH,
+                 retention: int = BACKUP_RETENTION, pages_per_step: int = BACKUP_PAGES_PER_STEP,
+                 step_sleep: float = BACKUP_STEP_SLEEP):
+        self.database_path = database_path
+        self.backup_dir = backup_dir
+        self.retention = retention
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._lock = asyncio.Lock()
+
+    def list_snapshots(self) -> list:
+        """Возвращает имена снимков, от новых к старым."""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = [
+            name for name in os.listdir(self.backup_dir)
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+        ]
+        return sorted(names, reverse=True)
+
+    def _copy(self, source_path: str, target_path: str) -> None:
+        """Копирует базу небольшими шагами, между которыми другие соединения не блокируются."""
+        with sqlite3.connect(source_path) as source, sqlite3.connect(target_path) as target:
+            source.backup(target, pages=self.pages_per_step, sleep=self.step_sleep)
+
+    def _create_snapshot(self) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{SNAPSHOT_SUFFIX}"
+        target_path = os.path.join(self.backup_dir, name)
+        temp_path = target_path + ".part"
+
+        metrics.set_gauge("backup_in_progress", 1)
+        started = time.perf_counter()
+        try:
+            self._copy(self.database_path, temp_path)
+            # Недописанный снимок никогда не попадает под имя, которое видит restore
+            os.replace(temp_path, target_path)
+        finally:
+            metrics.set_gauge("backup_in_progress", 0)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        metrics.observe("backup_duration", time.perf_counter() - started)
+
+        self._apply_retention()
+        logging.info(f"Создан снимок базы данных: {name}")
+        return name
+
+    def _apply_retention(self) -> None:
+        """Удаляет самые старые снимки сверх лимита хранения."""
+        for name in self.list_snapshots()[self.retention:]:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+            except OSError as e:
+                logging.error(f"Ошибка при удалении старого снимка {name}: {e}")
+
+    @staticmethod
+    def validate_snapshot(snapshot_path: str) -> bool:
+        """Проверяет целостность снимка и наличие таблицы users со всеми столбцами, которые читает поиск."""
+        if not os.path.isfile(snapshot_path):
+            return False
+        try:
+            with sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("PRAGMA integrity_check")
+                if cursor.fetchone()[0] != "ok":
+                    return False
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+                if cursor.fetchone() is None:
+                    return False
+                cursor.execute(
+                    "SELECT code, contact_text, chat_id, img, contact_body, contact_payload FROM users LIMIT 1"
+                )
+                return True
+        except sqlite3.Error as e:
+            logging.error(f"Снимок {snapshot_path} не прошёл проверку: {e}")
+            return False
+
+    def _restore(self, name: str) -> tuple:
+        """Подменяет базу снимком; возвращает (сообщение, восстановлена ли база)."""
+        if os.path.basename(name) != name or name not in self.list_snapshots():
+            return f"Снимок {name} не найден.", False
+        snapshot_path = os.path.join(self.backup_dir, name)
+        if not self.validate_snapshot(snapshot_path):
+            return f"Снимок {name} повреждён, восстановление отменено.", False
+
+        # Сохраняем текущую базу на случай отката тем же backup API: копия согласована даже при записи
+        if os.path.exists(self.database_path):
+            safety_path = self.database_path + ".before-restore"
+            temp_path = safety_path + ".part"
+            try:
+                self._copy(self.database_path, temp_path)
+                os.replace(temp_path, safety_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        # Записываем снимок поверх живой базы через backup API, открытые соединения остаются валидными
+        self._copy(snapshot_path, self.database_path)
+        logging.info(f"База данных восстановлена из снимка {name}")
+        return f"База данных восстановлена из снимка {name}.", True
+
+    async def create_snapshot(self) -> str:
+        """Создаёт снимок в отдельном потоке; одновременно выполняется только одна операция."""
+        async with self._lock:
+            return await asyncio.to_thread(self._create_snapshot)
+
+    async def restore(self, name: str) -> str:
+        """Проверяет снимок и подменяет им текущую базу данных."""
+        async with self._lock:
+            result, restored = await asyncio.to_thread(self._restore, name)
+        if restored:
+            # Кэши общие с обработчиками, поэтому сбрасываются в потоке цикла событий
+            with using_database(self.database_path):
+                invalidate_lookup_cache()
+                # Таблица ролей тоже заменена снимком — роли перечитываются при следующем обращении
+                access_control.invalidate()
+        return result
+
+    async def run(self) -> None:
+        """Периодически создаёт снимки базы данных."""
+        while True:
+            await asyncio.sleep(BACKUP_INTERVAL)
+            try:
+                await self.create_snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка при создании снимка базы данных: {e}")
+
+
+def backup_dir_for(database_path: str) -> str:
+    """Каталог снимков базы: основная база — BACKUP_PATH, остальные — подкаталоги по имени файла."""
+    if database_path == DATABASE_PATH:
+        return BACKUP_PATH
+    return os.path.join(BACKUP_PATH, os.path.splitext(os.path.basename(database_path))[0])
+
+
+# Резервное копирование для каждой базы контактов
+database_backups = {path: DatabaseBackup(path, backup_dir_for(path)) for path in ALL_DATABASE_PATHS}
+
+
+def get_database_backup() -> DatabaseBackup:
+    """Возвращает резервное копирование базы текущего бота."""
+    database_path = get_database_path()
+    if database_path not in database_backups:
+        database_backups[database_path] = DatabaseBackup(database_path, backup_dir_for(database_path))
+    return database_backups[database_path]
@@ -1,26 +1,144 @@
 import logging
 import os
+import time
+import signal
+import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import BOT_CONFIGS, ALL_DATABASE_PATHS, ALLOWED_USER_IDS, SHUTDOWN_TIMEOUT
+from logging_setup import setup_logging, stop_logging
+
+# Логирование настраивается до импорта остальных модулей, чтобы их записи шли через очередь
+setup_logging()
+
 from handlers.user_handlers import router as user_router
-from handlers.admin_handlers import router as admin_router
+from handlers.admin_handlers import router as admin_router, export_tasks
+from image_gc import ImageGarbageCollector
+from backup import database_backups
+from analytics import lookup_analytics
+from load_shedding import load_shedder
+from maintenance import create_maintenance_scheduler
+from dp_manager import (
+    configure_database, create_users_table, create_search_index, ensure_contact_body_column,
+    ensure_contact_payload_column, migrate_code_format, create_file_ids_table,
+    create_acl_table, create_polling_state_tables, create_idempotency_table, create_user_activity_table,
+    using_database
+)
+from telegram_api import create_bot_session
+from middlewares.middlewares import LogContextMiddleware, DatabaseContextMiddleware, RoleMiddleware
+from update_scheduler import UpdateScheduler, run_polling, persist_fsm_storage, restore_fsm_storage
 
-logging.basicConfig(level=logging.INFO)
 
-# Инициализация бота и диспетчера   
-bot = Bot(token=BOT_TOKEN, parse_mode=None)
+# Инициализация ботов и диспетчера
+# Все боты используют одну HTTP-сессию, один диспетчер с роутерами и одно хранилище FSM
+# (ключи хранилища включают bot_id, поэтому состояния ботов не пересекаются)
+session = create_bot_session()
+bots = [Bot(token=token, parse_mode=None, session=session) for token, _ in BOT_CONFIGS]
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(LogContextMiddleware())
+dp.update.outer_middleware(DatabaseContextMiddleware(
+    {bot.id: database_path for bot, (_, database_path) in zip(bots, BOT_CONFIGS)}
+))
+dp.update.outer_middleware(RoleMiddleware())
 
 # Подключаем роутеры (админский роутер должен быть первым)
 dp.include_router(admin_router)  # Сначала проверяем админские команды
 dp.include_router(user_router)   # Затем пользовательские
 
+def prepare_database(database_path: str):
+    """Создаёт индексы и выполняет миграции базы контактов."""
+    with using_database(database_path):
+        # Журнал WAL и инкрементальная очистка для контрольных точек и VACUUM из maintenance.py
+        configure_database()
+        # Новая база бота со своими контактами начинается с пустой таблицы users
+        create_users_table()
+        # Текст контакта для ответов в inline-режиме и полнотекстового поиска
+        ensure_contact_body_column()
+        # Полнотекстовый индекс для поиска контактов админами (нужен столбец contact_body)
+        create_search_index()
+        # Снимок сообщения контакта для ответа без copy_message
+        ensure_contact_payload_column()
+        # Старые 4-значные коды переводятся в текущий формат
+        migrate_code_format()
+        # file_id загруженных изображений для повторной отправки без загрузки
+        create_file_ids_table()
+        # Роли админов и модераторов (первый запуск переносит ALLOWED_USER_IDS)
+        create_acl_table(ALLOWED_USER_IDS)
+        # Ключи идемпотентности: повторная доставка не повторяет изменения админов
+        create_idempotency_table()
+
+def install_signal_handlers(stop_event: asyncio.Event) -> None:
+    """По SIGTERM/SIGINT запускает плавную остановку вместо прерывания посреди обработки."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остаётся KeyboardInterrupt, остановка идёт через finally
+            pass
+
+async def drain_export_tasks(timeout: float) -> None:
+    """Даёт фоновым выгрузкам изображений завершиться, оставшиеся отменяет."""
+    if export_tasks:
+        await asyncio.wait(set(export_tasks), timeout=max(0, timeout))
+    for task in export_tasks:
+        task.cancel()
+    await asyncio.gather(*export_tasks, return_exceptions=True)
+
 async def main():
-    await dp.start_polling(bot)
+    for database_path in ALL_DATABASE_PATHS:
+        prepare_database(database_path)
+    # Сдвиг getUpdates и необработанные при остановке обновления (в основной базе)
+    create_polling_state_tables()
+    # История пользователей для защиты от перебора кодов (переживает перезапуск)
+    create_user_activity_table()
+    # Фоновое удаление изображений и поиск файлов-сирот
+    gc_task = asyncio.create_task(ImageGarbageCollector().run())
+    # Периодическое онлайн-резервное копирование базы данных
+    backup_tasks = [asyncio.create_task(backup.run()) for backup in database_backups.values()]
+    # Отложенная запись статистики поиска кодов
+    analytics_task = asyncio.create_task(lookup_analytics.run())
+    # Отложенная запись истории пользователей защиты от перебора
+    shedder_task = asyncio.create_task(load_shedder.run())
+    # Контрольные точки WAL, статистика планировщика SQLite, очистка модерации и FSM
+    maintenance_task = asyncio.create_task(create_maintenance_scheduler(storage).run())
+
+    stop_event = asyncio.Event()
+    install_signal_handlers(stop_event)
+    # Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+    scheduler = UpdateScheduler(dp)
+    polling_tasks = []
+    try:
+        # Состояния FSM восстанавливаются до сохранённых обновлений, чтобы те попали в свои сценарии
+        await restore_fsm_storage(storage)
+        for bot in bots:
+            await scheduler.replay_pending(bot)
+        polling_tasks = [asyncio.create_task(run_polling(bot, dp, scheduler)) for bot in bots]
+        await stop_event.wait()
+        logging.info("Получен сигнал остановки, завершаем обработку обновлений")
+    finally:
+        # 1. Перестаём получать обновления; сдвиг сохраняется при отмене run_polling
+        for polling_task in polling_tasks:
+            polling_task.cancel()
+        await asyncio.gather(*polling_tasks, return_exceptions=True)
+
+        # 2. Дожидаемся принятых обновлений и выгрузок; не успевшие сохраняются для следующего запуска
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        await scheduler.drain(SHUTDOWN_TIMEOUT)
+        await drain_export_tasks(deadline - time.monotonic())
+        # Состояния FSM хранятся в памяти: сохраняем их вместе с необработанными обновлениями
+        await persist_fsm_storage(storage)
+
+        # 3. Останавливаем фоновые задачи; статистика поиска и история пользователей сохраняются в БД при отмене
+        background_tasks = [gc_task, analytics_task, shedder_task, maintenance_task, *backup_tasks]
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await session.close()
+        logging.info("Бот остановлен")
+        stop_logging()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
  
\ No newline at end of file
@@ -0,0 +1,140 @@
+import random
+import time
+
+from config import CODE_RESERVATION_TTL, CODE_FREE_LIST_LIMIT
+from codes import CODE_SPACE_SIZE, format_code, parse_code
+from dp_manager import get_all_codes, check_code_exists, get_database_path
+
+# Сколько случайных кодов пробовать в разреженном пространстве до отказа
+MAX_RANDOM_PROBES = 32
+
+
+class CodeAllocator:
+    """Выдача свободных кодов за O(1) со временным резервированием.
+
+    Небольшое пространство кодов хранится списком свободных кодов; в большом пространстве
+    (больше CODE_FREE_LIST_LIMIT) занята малая доля кодов, и случайный код почти всегда свободен,
+    поэтому он выбирается случайно и проверяется по индексу в БД.
+    """
+
+    def __init__(self, reservation_ttl: float = CODE_RESERVATION_TTL,
+                 space_size: int = CODE_SPACE_SIZE, free_list_limit: int = CODE_FREE_LIST_LIMIT):
+        self.reservation_ttl = reservation_ttl
+        self.space_size = space_size
+        self.use_free_list = space_size <= free_list_limit
+        self._free = []  # Свободные коды
+        self._positions = {}  # code: индекс в self._free
+        self._reserved = {}  # code: (owner_id, expires_at)
+        self._loaded = False
+
+    def _load(self) -> None:
+        """Строит список свободных кодов по данным из БД (один раз при первом обращении)."""
+        self._reserved = {}
+        self._free = []
+        self._positions = {}
+        if self.use_free_list:
+            used = bytearray(self.space_size)
+            for code in get_all_codes():
+                number = parse_code(code)
+                if number is not None:
+                    used[number] = 1
+            self._free = [format_code(n) for n in range(self.space_size) if not used[n]]
+            self._positions = {code: index for index, code in enumerate(self._free)}
+        self._loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self._load()
+
+    def _is_free(self, code: str) -> bool:
+        if self.use_free_list:
+            return code in self._positions
+        return code not in self._reserved and not check_code_exists(code)
+
+    def _add_free(self, code: str) -> None:
+        if self.use_free_list and code not in self._positions and parse_code(code) is not None:
+            self._positions[code] = len(self._free)
+            self._free.append(code)
+
+    def _remove_free(self, code: str) -> None:
+        """Удаляет код из списка свободных за O(1): меняем местами с последним и укорачиваем."""
+        if code not in self._positions:
+            return
+        index = self._positions.pop(code)
+        last = self._free.pop()
+        if index < len(self._free):
+            self._free[index] = last
+            self._positions[last] = index
+
+    def _expire_reservations(self) -> None:
+        now = time.monotonic()
+        for code, (_, expires_at) in list(self._reserved.items()):
+            if expires_at <= now:
+                del self._reserved[code]
+                self._add_free(code)
+
+    def _random_code(self):
+        if self.use_free_list:
+            return self._free[random.randrange(len(self._free))] if self._free else None
+        for _ in range(MAX_RANDOM_PROBES):
+            code = format_code(random.randrange(self.space_size))
+            if self._is_free(code):
+                return code
+        return None
+
+    def reserve(self, code: str, owner_id: int) -> bool:
+        """Резервирует конкретный код; повторный резерв тем же владельцем продлевает его."""
+        self._ensure_loaded()
+        self._expire_reservations()
+        expires_at = time.monotonic() + self.reservation_ttl
+        if code in self._reserved:
+            if self._reserved[code][0] != owner_id:
+                return False
+            self._reserved[code] = (owner_id, expires_at)
+            return True
+        if not self._is_free(code):
+            return False
+        self._remove_free(code)
+        self._reserved[code] = (owner_id, expires_at)
+        return True
+
+    def allocate(self, owner_id: int):
+        """Резервирует случайный свободный код и возвращает его (None, если коды закончились)."""
+        self._ensure_loaded()
+        self._expire_reservations()
+        code = self._random_code()
+        if code is None:
+            return None
+        self._remove_free(code)
+        self._reserved[code] = (owner_id, time.monotonic() + self.reservation_ttl)
+        return code
+
+    def commit(self, code: str) -> None:
+        """Помечает код занятым после сохранения контакта."""
+        if not self._loaded:
+            return
+        self._reserved.pop(code, None)
+        self._remove_free(code)
+
+    def release(self, code: str) -> None:
+        """Возвращает код в список свободных (отмена резерва или удаление контакта)."""
+        if not self._loaded:
+            return
+        self._reserved.pop(code, None)
+        self._add_free(code)
+
+    def reset(self) -> None:
+        """Сбрасывает состояние; список будет перестроен из БД при следующем обращении."""
+        self._loaded = False
+
+
+# Распределители кодов для каждой базы контактов
+code_allocators = {}
+
+
+def get_code_allocator() -> CodeAllocator:
+    """Возвращает распределитель кодов для базы текущего бота."""
+    database_path = get_database_path()
+    if database_path not in code_allocators:
+        code_allocators[database_path] = CodeAllocator()
+    return code_allocators[database_path]
@@ -0,0 +1,67 @@
+from config import CODE_LENGTH, CODE_ALPHABET, LEGACY_CODE_LENGTH
+
+# Символы алфавита для быстрой проверки и их позиции для перевода кода в число
+ALPHABET_SET = frozenset(CODE_ALPHABET)
+ALPHABET_INDEX = {symbol: index for index, symbol in enumerate(CODE_ALPHABET)}
+BASE = len(CODE_ALPHABET)
+
+# Размер пространства кодов
+CODE_SPACE_SIZE = BASE ** CODE_LENGTH
+
+# Алфавит без строчных букв означает, что ввод не зависит от регистра
+CASE_INSENSITIVE = CODE_ALPHABET == CODE_ALPHABET.upper()
+
+# Подсказка о формате кода для сообщений пользователю
+if CODE_ALPHABET.isdigit():
+    CODE_FORMAT_HINT = f"{CODE_LENGTH} цифр"
+else:
+    CODE_FORMAT_HINT = f"{CODE_LENGTH} символов ({CODE_ALPHABET})"
+
+
+def normalize_code(text: str) -> str:
+    """Приводит ввод к каноническому виду: регистр и перевод старых 4-значных кодов в текущий формат."""
+    code = (text or "").strip()
+    if CASE_INSENSITIVE:
+        code = code.upper()
+    # Старые цифровые коды переводятся в текущий формат так же, как при миграции базы
+    legacy = upgrade_legacy_code(code)
+    return legacy if legacy is not None else code
+
+
+def upgrade_legacy_code(code: str):
+    """Переводит старый 4-значный цифровой код в текущий формат по его числовому значению.
+
+    Возвращает None, если код не старого формата или его номер не помещается в пространство кодов.
+    """
+    if LEGACY_CODE_LENGTH >= CODE_LENGTH or len(code) != LEGACY_CODE_LENGTH:
+        return None
+    if not (code.isascii() and code.isdigit()):
+        return None
+    number = int(code)
+    if number >= CODE_SPACE_SIZE:
+        return None
+    return format_code(number)
+
+
+def validate_code(code: str) -> bool:
+    """Проверяет, что код имеет нужную длину и состоит из символов алфавита."""
+    return bool(code) and len(code) == CODE_LENGTH and all(symbol in ALPHABET_SET for symbol in code)
+
+
+def format_code(number: int) -> str:
+    """Преобразует номер в код из символов алфавита фиксированной длины."""
+    symbols = []
+    for _ in range(CODE_LENGTH):
+        number, index = divmod(number, BASE)
+        symbols.append(CODE_ALPHABET[index])
+    return "".join(reversed(symbols))
+
+
+def parse_code(code: str):
+    """Преобразует код в номер (None, если код не из текущего пространства)."""
+    if not validate_code(code):
+        return None
+    number = 0
+    for symbol in code:
+        number = number * BASE + ALPHABET_INDEX[symbol]
+    return number
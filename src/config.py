@@ -22,8 +22,138 @@ if not os.path.exists(TEMP_IMAGES_PATH):
 # Токен для Telegram-бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# Список разрешенных ID пользователей
+# Несколько ботов в одном процессе: "токен1,токен2|brand2"
+# Бот без суффикса использует общую базу DATABASE_PATH, с суффиксом — свою db/<имя>.sqlite3
+BOT_TOKENS = os.getenv("BOT_TOKENS", "")
+
+def parse_bot_configs(spec: str) -> list:
+    """Разбирает BOT_TOKENS в список (токен, путь к базе контактов)."""
+    configs = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        token, _, database_name = item.partition("|")
+        database_path = (
+            os.path.join(BASE_DIR, 'db', f"{database_name.strip()}.sqlite3")
+            if database_name.strip() else DATABASE_PATH
+        )
+        configs.append((token.strip(), database_path))
+    return configs
+
+BOT_CONFIGS = parse_bot_configs(BOT_TOKENS) or [(BOT_TOKEN, DATABASE_PATH)]
+
+# Все базы контактов, которые обслуживают фоновые задачи
+ALL_DATABASE_PATHS = list(dict.fromkeys(path for _, path in BOT_CONFIGS))
+
+def render_images_dir(database_path: str) -> str:
+    """Папка изображений с кодами для базы контактов.
+
+    Коды разных баз могут совпадать, поэтому у каждой дополнительной базы своя подпапка;
+    основная база DATABASE_PATH использует прежнюю папку.
+    """
+    base_dir = os.path.join(TEMP_IMAGES_PATH, 'user_images')
+    if os.path.abspath(database_path) == os.path.abspath(DATABASE_PATH):
+        return base_dir
+    return os.path.join(base_dir, os.path.splitext(os.path.basename(database_path))[0])
+
+# Собственный сервер Bot API (пусто — используется api.telegram.org)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "")  # Например, http://localhost:8081
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "0") == "1"  # Сервер запущен с флагом --local
+TELEGRAM_API_SERVER_FILES_DIR = os.getenv("TELEGRAM_API_SERVER_FILES_DIR", "")  # Каталог файлов на стороне сервера
+TELEGRAM_API_LOCAL_FILES_DIR = os.getenv("TELEGRAM_API_LOCAL_FILES_DIR", "")  # Тот же каталог, как он виден боту
+
+# Начальные администраторы: заносятся в таблицу ролей acl, пока она пуста
+# (дальше роли назначаются командами /grant и /revoke)
 ALLOWED_USER_IDS = [5762200816, 7179744401, 905319412, 1629696900]
 
+# Сборщик мусора для изображений
+IMAGE_GC_SCAN_INTERVAL = int(os.getenv("IMAGE_GC_SCAN_INTERVAL", 3600))  # Период поиска файлов-сирот, сек
+IMAGE_GC_DRAIN_INTERVAL = float(os.getenv("IMAGE_GC_DRAIN_INTERVAL", 1))  # Период разбора очереди удаления, сек
+IMAGE_GC_BATCH_SIZE = int(os.getenv("IMAGE_GC_BATCH_SIZE", 500))  # Размер пачки строк при сверке с БД
+IMAGE_GC_CONCURRENCY = int(os.getenv("IMAGE_GC_CONCURRENCY", 4))  # Максимум одновременных операций с диском
+IMAGE_GC_MIN_AGE = int(os.getenv("IMAGE_GC_MIN_AGE", 600))  # Не трогаем файлы моложе этого возраста, сек
+
+# Резервное копирование базы данных
+BACKUP_PATH = os.path.join(BASE_DIR, 'db', 'backups')
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 6 * 3600))  # Период создания снимков, сек
+BACKUP_RETENTION = int(os.getenv("BACKUP_RETENTION", 10))  # Сколько снимков хранить
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", 64))  # Страниц за один шаг копирования
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", 0.01))  # Пауза между шагами, сек
+
+# Статистика поиска кодов
+ANALYTICS_FLUSH_INTERVAL = int(os.getenv("ANALYTICS_FLUSH_INTERVAL", 60))  # Период сброса счётчиков в БД, сек
+
+# Формат кодов
+CODE_LENGTH = int(os.getenv("CODE_LENGTH", 4))  # Длина кода
+CODE_ALPHABET = os.getenv("CODE_ALPHABET", "0123456789")  # Допустимые символы (по порядку значений разрядов)
+LEGACY_CODE_LENGTH = 4  # Длина старых цифровых кодов, которые переводятся в текущий формат при миграции
+CODE_FREE_LIST_LIMIT = int(os.getenv("CODE_FREE_LIST_LIMIT", 100_000))  # До этого размера коды выдаются из списка свободных
+
+# Поиск по кодам
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 10000))  # Сколько найденных кодов держать в памяти
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16384))  # Кэш страниц соединения для чтения, КБ
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # Размер отображения файла БД в память
+
+# Сколько держать автоматически выданный или введённый код за админом, сек
+CODE_RESERVATION_TTL = int(os.getenv("CODE_RESERVATION_TTL", 900))
+
+# Количество результатов поиска на одной странице
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 10))
+
+# Кэширование результатов inline-режима на стороне Telegram, сек
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))  # Для найденных кодов (общий кэш)
+INLINE_MISS_CACHE_TIME = int(os.getenv("INLINE_MISS_CACHE_TIME", 10))  # Для промахов (личный кэш)
+
+# Логирование
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # Общий уровень логирования
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # Уровни по модулям, например "dp_manager=WARNING,aiogram=INFO"
+LOG_RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_WINDOW", 10))  # Окно подавления повторов, сек
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", 5))  # Одинаковых сообщений за окно
+
+# Обработка обновлений в режиме polling
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 16))  # Одновременно обрабатываемых обновлений
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", 256))  # Необработанных обновлений до паузы getUpdates
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", 30))  # Таймаут long polling, сек
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", 10_000))  # Сколько последних update_id помнить
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", 3600))  # Сколько помнить update_id, сек
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 7 * 24 * 3600))  # Хранение ключей изменений админов, сек
+
+# Плавная остановка: сколько ждать обработки принятых обновлений и выгрузок, сек
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 20))
+# Сколько ещё ждать начатые защищённые секции обработчиков (запись контакта и ответ), сек
+SHUTDOWN_CRITICAL_TIMEOUT = float(os.getenv("SHUTDOWN_CRITICAL_TIMEOUT", 10))
+
+# Экспорт изображений кодов
+EXPORT_GROUP_INTERVAL = float(os.getenv("EXPORT_GROUP_INTERVAL", 3))  # Пауза между альбомами, сек
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 200))  # Строк из БД за один запрос
+
+# Как часто проверять, не изменилась ли таблица ролей acl, сек
+ACL_RELOAD_INTERVAL = float(os.getenv("ACL_RELOAD_INTERVAL", 5))
+
+# Защита от перебора кодов с множества аккаунтов (защищённый режим)
+SHED_ENABLED = os.getenv("SHED_ENABLED", "1") == "1"
+SHED_WINDOW = int(os.getenv("SHED_WINDOW", 60))  # Скользящее окно подсчёта промахов, сек
+SHED_MISS_THRESHOLD = int(os.getenv("SHED_MISS_THRESHOLD", 300))  # Промахов за окно по всем пользователям
+SHED_MISS_RATIO = float(os.getenv("SHED_MISS_RATIO", 0.5))  # ...и их минимальная доля среди поисков
+SHED_CODE_MISS_THRESHOLD = int(os.getenv("SHED_CODE_MISS_THRESHOLD", 50))  # Промахов за окно по одному коду
+SHED_COOLDOWN = float(os.getenv("SHED_COOLDOWN", 600))  # Сколько держать режим после последнего всплеска, сек
+SHED_MIN_USER_AGE = float(os.getenv("SHED_MIN_USER_AGE", 3600))  # Пользователь моложе этого считается новым, сек
+SHED_BASE_DELAY = float(os.getenv("SHED_BASE_DELAY", 2))  # Пауза после первого промаха в режиме, сек
+SHED_MAX_DELAY = float(os.getenv("SHED_MAX_DELAY", 600))  # Максимальная пауза, сек
+SHED_MAX_USERS = int(os.getenv("SHED_MAX_USERS", 100_000))  # Сколько пользователей отслеживать (LRU)
+SHED_FLUSH_INTERVAL = float(os.getenv("SHED_FLUSH_INTERVAL", 60))  # Период сохранения истории пользователей в БД, сек
+
+# Фоновое обслуживание БД и состояния в памяти (интервалы в секундах, к ним добавляется разброс)
+MAINTENANCE_CHECKPOINT_INTERVAL = float(os.getenv("MAINTENANCE_CHECKPOINT_INTERVAL", 300))  # Контрольная точка WAL
+MAINTENANCE_OPTIMIZE_INTERVAL = float(os.getenv("MAINTENANCE_OPTIMIZE_INTERVAL", 6 * 3600))  # ANALYZE / optimize
+MAINTENANCE_VACUUM_INTERVAL = float(os.getenv("MAINTENANCE_VACUUM_INTERVAL", 3600))  # Инкрементальный VACUUM
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", 1000))  # Страниц за один запуск
+MAINTENANCE_EXPIRY_INTERVAL = float(os.getenv("MAINTENANCE_EXPIRY_INTERVAL", 600))  # Очистка модерации и FSM
+MAINTENANCE_JITTER = float(os.getenv("MAINTENANCE_JITTER", 0.1))  # Разброс интервала, доля
+MAINTENANCE_MAX_LOOKUP_P95 = float(os.getenv("MAINTENANCE_MAX_LOOKUP_P95", 0.005))  # Выше — обслуживание откладывается, сек
+MAINTENANCE_RETRY_DELAY = float(os.getenv("MAINTENANCE_RETRY_DELAY", 60))  # Через сколько повторить отложенную задачу
+MODERATION_STATE_TTL = int(os.getenv("MODERATION_STATE_TTL", 7 * 24 * 3600))  # Хранение записей модерации без мута
+
 # Другие настройки
 DEBUG_MODE = True
\ No newline at end of file
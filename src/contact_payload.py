@@ -0,0 +1,63 @@
+import json
+
+from aiogram import Bot
+from aiogram.types import Message, MessageEntity
+
+# Типы вложений, которые сохраняются в снимке: тип -> (метод Bot, имя параметра файла)
+MEDIA_SENDERS = {
+    "photo": ("send_photo", "photo"),
+    "video": ("send_video", "video"),
+    "animation": ("send_animation", "animation"),
+    "document": ("send_document", "document"),
+    "audio": ("send_audio", "audio"),
+    "voice": ("send_voice", "voice"),
+}
+
+
+def snapshot_message(message: Message, bot_id: int):
+    """Сохраняет текст, разметку и file_id вложения сообщения в компактный JSON (None, если сохранять нечего).
+
+    Ключи: t — текст или подпись, e — entities, m — [тип вложения, file_id], b — бот, которому принадлежит file_id.
+    """
+    payload = {}
+    text = message.text or message.caption
+    if text:
+        payload["t"] = text
+    entities = message.entities or message.caption_entities
+    if entities:
+        payload["e"] = [entity.dict(exclude_none=True) for entity in entities]
+    for kind in MEDIA_SENDERS:
+        media = getattr(message, kind)
+        if media:
+            # У фото берём самый большой размер
+            file_id = media[-1].file_id if kind == "photo" else media.file_id
+            payload["m"] = [kind, file_id]
+            payload["b"] = bot_id
+            break
+    if "t" not in payload and "m" not in payload:
+        return None
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def can_send_locally(payload: str, bot_id: int) -> bool:
+    """Проверяет, можно ли собрать ответ из снимка (file_id действителен только для загрузившего бота)."""
+    if not payload:
+        return False
+    data = json.loads(payload)
+    return "m" not in data or data.get("b") == bot_id
+
+
+async def send_contact_payload(bot: Bot, chat_id: int, payload: str, reply_markup=None) -> Message:
+    """Отправляет контакт из снимка без обращения к исходному сообщению админа."""
+    data = json.loads(payload)
+    text = data.get("t")
+    entities = [MessageEntity(**entity) for entity in data.get("e", ())] or None
+    if "m" not in data:
+        return await bot.send_message(chat_id, text, entities=entities, reply_markup=reply_markup)
+
+    kind, file_id = data["m"]
+    method, argument = MEDIA_SENDERS[kind]
+    return await getattr(bot, method)(
+        chat_id, **{argument: file_id},
+        caption=text, caption_entities=entities, reply_markup=reply_markup
+    )
@@ -1,31 +1,106 @@
 import os
 import sys
+import queue
 import sqlite3
 import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
 from config import DATABASE_PATH  # Путь к базе данных
+from config import (
+    CODE_LENGTH, LEGACY_CODE_LENGTH,
+    LOOKUP_CACHE_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+)
+from codes import upgrade_legacy_code
+from metrics import metrics
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # Константа для исключения stock_image.png
 EXCLUDED_IMAGE = "stock_image.png"
 
+# Очередь файлов на удаление (разбирается фоновым сборщиком из image_gc.py)
+image_removal_queue = queue.SimpleQueue()
+
+# База контактов текущего бота (None — основная база DATABASE_PATH)
+current_database_path = contextvars.ContextVar("current_database_path", default=None)
+
+# Постоянные соединения для чтения (по одному на поток и базу) и кэш горячих кодов
+_read_local = threading.local()
+_lookup_cache = OrderedDict()  # (database_path, code): (contact_text, chat_id, contact_payload)
+
+def get_database_path() -> str:
+    """Возвращает путь к базе контактов, с которой работает текущее обновление или задача."""
+    return current_database_path.get() or DATABASE_PATH
+
+@contextmanager
+def using_database(database_path: str):
+    """Временно переключает функции модуля на указанную базу контактов."""
+    token = current_database_path.set(database_path)
+    try:
+        yield
+    finally:
+        current_database_path.reset(token)
+
+def get_read_connection() -> sqlite3.Connection:
+    """Возвращает постоянное соединение только для чтения, открытое в текущем потоке."""
+    connections = getattr(_read_local, "connections", None)
+    if connections is None:
+        connections = _read_local.connections = {}
+    database_path = get_database_path()
+    conn = connections.get(database_path)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(database_path)
+    # Больший кэш страниц и mmap держат индекс кодов в памяти
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA query_only = 1")
+    connections[database_path] = conn
+    return conn
+
+def invalidate_lookup_cache(code: str = None) -> None:
+    """Удаляет код (или все коды) текущей базы из кэша поиска."""
+    database_path = get_database_path()
+    if code is not None:
+        _lookup_cache.pop((database_path, code), None)
+        return
+    for key in [key for key in _lookup_cache if key[0] == database_path]:
+        del _lookup_cache[key]
+
+def _get_idempotent_result(cursor: sqlite3.Cursor, idempotency_key: str):
+    """Возвращает сохранённый результат изменения с этим ключом (None — изменение ещё не выполнялось)."""
+    if idempotency_key is None:
+        return None
+    cursor.execute("SELECT result FROM idempotency_keys WHERE key = ?", (idempotency_key,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def _save_idempotent_result(cursor: sqlite3.Cursor, idempotency_key: str, result: str) -> None:
+    """Запоминает результат изменения в той же транзакции, что и само изменение."""
+    if idempotency_key is not None:
+        cursor.execute(
+            "INSERT OR REPLACE INTO idempotency_keys (key, result) VALUES (?, ?)",
+            (idempotency_key, result)
+        )
+
 def check_and_create_db_folder():
     """Проверка и создание папки для базы данных, если она не существует."""
-    db_folder = os.path.dirname(DATABASE_PATH)
+    db_folder = os.path.dirname(get_database_path())
     if not os.path.exists(db_folder):
         try:
             os.makedirs(db_folder)
-            logging.info(f"Создана папка для базы данных: {db_folder}")
+            logger.info(f"Создана папка для базы данных: {db_folder}")
         except Exception as e:
-            logging.error(f"Ошибка при создании папки для базы данных: {e}")
+            logger.error(f"Ошибка при создании папки для базы данных: {e}")
             sys.exit(1)
 
 def create_database_and_table():
     """Создаёт базу данных и таблицу users, если они не существуют."""
     check_and_create_db_folder()
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
             
             # Проверяем существование старой таблицы
@@ -40,7 +115,8 @@ def create_database_and_table():
                         code TEXT UNIQUE,
                         contact_text TEXT,
                         chat_id INTEGER,
-                        img TEXT
+                        img TEXT,
+                        contact_body TEXT
                     )
                 ''')
                 
@@ -56,7 +132,7 @@ def create_database_and_table():
                             (code, str(message_id), chat_id, img)
                         )
                 except sqlite3.Error as e:
-                    logging.error(f"Ошибка при миграции данных: {e}")
+                    logger.error(f"Ошибка при миграции данных: {e}")
                 
                 # Удаляем старую таблицу и переименовываем новую
                 cursor.execute("DROP TABLE users")
@@ -69,140 +145,286 @@ def create_database_and_table():
                         code TEXT UNIQUE,
                         contact_text TEXT,
                         chat_id INTEGER,
-                        img TEXT
+                        img TEXT,
+                        contact_body TEXT
                     )
                 ''')
             
             conn.commit()
-            logging.info("База данных успешно обновлена или создана.")
+            logger.info("База данных успешно обновлена или создана.")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании/обновлении базы данных: {e}")
+
+def create_users_table():
+    """Создаёт таблицу users в новой базе контактов, не трогая существующую."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    code TEXT UNIQUE,
+                    contact_text TEXT,
+                    chat_id INTEGER,
+                    img TEXT,
+                    contact_body TEXT,
+                    contact_payload TEXT
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблицы users: {e}")
+
+def ensure_contact_body_column():
+    """Добавляет столбец contact_body (текст контакта для inline-режима) в существующую таблицу users."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(users)")
+            columns = {row[1] for row in cursor.fetchall()}
+            if columns and "contact_body" not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN contact_body TEXT")
+                conn.commit()
+                logger.info("В таблицу users добавлен столбец contact_body.")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при добавлении столбца contact_body: {e}")
+
+def ensure_contact_payload_column():
+    """Добавляет столбец contact_payload (снимок сообщения контакта) в существующую таблицу users."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(users)")
+            columns = {row[1] for row in cursor.fetchall()}
+            if columns and "contact_payload" not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN contact_payload TEXT")
+                conn.commit()
+                logger.info("В таблицу users добавлен столбец contact_payload.")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при добавлении столбца contact_payload: {e}")
+
+def migrate_code_format():
+    """Переводит старые 4-значные цифровые коды в текущий формат (codes.upgrade_legacy_code).
+
+    Код, который уже занят в новом формате, не переносится: для users это записывается в лог,
+    чтобы админ разобрал дубль вручную, а счётчики code_stats складываются.
+    """
+    if LEGACY_CODE_LENGTH >= CODE_LENGTH:
+        return
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            for table in ("users", "code_stats"):
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+                if cursor.fetchone() is None:
+                    continue
+                cursor.execute(
+                    f"SELECT code FROM {table} WHERE length(code) = ? AND code NOT GLOB '*[^0-9]*'",
+                    (LEGACY_CODE_LENGTH,)
+                )
+                migrated = 0
+                for (code,) in cursor.fetchall():
+                    new_code = upgrade_legacy_code(code)
+                    if new_code is None:
+                        logger.warning("Код %s не помещается в текущий формат и не перенесён.", code)
+                        continue
+                    try:
+                        cursor.execute(f"UPDATE {table} SET code = ? WHERE code = ?", (new_code, code))
+                        migrated += 1
+                    except sqlite3.IntegrityError:
+                        if table == "code_stats":
+                            cursor.execute('''
+                                UPDATE code_stats SET
+                                    hits = hits + (SELECT hits FROM code_stats WHERE code = ?),
+                                    misses = misses + (SELECT misses FROM code_stats WHERE code = ?)
+                                WHERE code = ?
+                            ''', (code, code, new_code))
+                            cursor.execute("DELETE FROM code_stats WHERE code = ?", (code,))
+                            migrated += 1
+                        else:
+                            logger.warning(
+                                "Код %s не перенесён: код %s уже занят другим контактом.", code, new_code
+                            )
+                if migrated:
+                    logger.info("Коды в таблице %s переведены в длину %s: %s", table, CODE_LENGTH, migrated)
+            conn.commit()
+        invalidate_lookup_cache()
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при создании/обновлении базы данных: {e}")
+        logger.error(f"Ошибка при миграции кодов: {e}")
 
 def check_code_exists(code: str) -> bool:
     """Проверяет существование кода в базе данных."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE code = ?", (code,))
-            return cursor.fetchone() is not None
+        cursor = get_read_connection().execute("SELECT 1 FROM users WHERE code = ?", (code,))
+        return cursor.fetchone() is not None
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при проверке кода: {e}")
+        logger.error(f"Ошибка при проверке кода: {e}")
         return False
 
-def add_user(code: str, contact_text: str, chat_id: int) -> str:
-    """Добавляет пользователя в таблицу, если код не занят."""
-    if check_code_exists(code):
-        return "Данный код занят, введите другой."
+def add_user(code: str, contact_text: str, chat_id: int, contact_body: str = None,
+             contact_payload: str = None, idempotency_key: str = None) -> tuple:
+    """Добавляет пользователя в таблицу, если код не занят (одним запросом, без гонки).
 
+    Возвращает (результат, повтор). Повторный вызов с тем же idempotency_key возвращает
+    прежний результат и повтор=True без записи в БД.
+    """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
+            stored = _get_idempotent_result(cursor, idempotency_key)
+            if stored is not None:
+                return stored, True
             cursor.execute('''
-                INSERT INTO users (code, contact_text, chat_id) 
-                VALUES (?, ?, ?)
-            ''', (code, contact_text, chat_id))
+                INSERT INTO users (code, contact_text, chat_id, contact_body, contact_payload) 
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(code) DO NOTHING
+            ''', (code, contact_text, chat_id, contact_body, contact_payload))
+            if cursor.rowcount == 0:
+                result = "Данный код занят, введите другой."
+            else:
+                logger.info("Запись с кодом добавлена.", extra={"code": code})
+                result = "Данные успешно сохранены."
+            _save_idempotent_result(cursor, idempotency_key, result)
             conn.commit()
-            logging.info(f"Запись с кодом {code} добавлена.")
-            return "Данные успешно сохранены."
+            return result, False
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при добавлении пользователя: {e}")
-        return "Произошла ошибка при добавлении данных."
+        logger.error(f"Ошибка при добавлении пользователя: {e}")
+        return "Произошла ошибка при добавлении данных.", False
+
+def delete_user_by_code(code: str, idempotency_key: str = None) -> tuple:
+    """Удаляет пользователя по коду, а также фотографию, если она прикреплена.
 
-def delete_user_by_code(code: str) -> str:
-    """Удаляет пользователя по коду, а также фотографию, если она прикреплена."""
+    Возвращает (результат, повтор), как add_user.
+    """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
+            stored = _get_idempotent_result(cursor, idempotency_key)
+            if stored is not None:
+                return stored, True
             cursor.execute("SELECT img FROM users WHERE code = ?", (code,))
             result = cursor.fetchone()
 
             if result:
-                img_path = result[0]
-                # Удаляем изображение, если это не stock_image.png
-                if img_path and img_path != EXCLUDED_IMAGE:
-                    delete_image(img_path)
+                # Ставим изображение в очередь на удаление, чтобы не ждать диск в обработчике
+                enqueue_image_removal(result[0])
 
             cursor.execute("DELETE FROM users WHERE code = ?", (code,))
-            conn.commit()
-
             if cursor.rowcount > 0:
-                logging.info(f"Запись с кодом {code} удалена.")
-                return f"Запись с кодом {code} и изображение (если было) удалены."
+                logger.info("Запись с кодом удалена.", extra={"code": code})
+                result = f"Запись с кодом {code} и изображение (если было) удалены."
             else:
-                logging.info(f"Запись с кодом {code} не найдена.")
-                return f"Запись с кодом {code} не найдена."
+                logger.info("Запись с кодом не найдена.", extra={"code": code})
+                result = f"Запись с кодом {code} не найдена."
+            _save_idempotent_result(cursor, idempotency_key, result)
+            conn.commit()
+            invalidate_lookup_cache(code)
+            return result, False
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при удалении пользователя: {e}")
-        return "Произошла ошибка при удалении данных."
+        logger.error(f"Ошибка при удалении пользователя: {e}")
+        return "Произошла ошибка при удалении данных.", False
 
 def get_contacts_by_code(code: str):
-    """Получает contact_text и chat_id по коду."""
+    """Получает contact_text, chat_id и снимок контакта по коду (найденные коды кэшируются в памяти)."""
+    cache_key = (get_database_path(), code)
+    cached = _lookup_cache.get(cache_key)
+    if cached is not None:
+        _lookup_cache.move_to_end(cache_key)
+        metrics.inc("lookup_cache_hits")
+        return cached
+
+    # Отдельно замеряем задержку поиска во время резервного копирования
+    timer_name = "lookup_latency_during_backup" if metrics.get_gauge("backup_in_progress") else "lookup_latency"
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT contact_text, chat_id FROM users WHERE code = ?",
+        with metrics.timer(timer_name):
+            cursor = get_read_connection().execute(
+                "SELECT contact_text, chat_id, contact_payload FROM users WHERE code = ?",
                 (code,)
             )
             result = cursor.fetchone()
-            return result if result else None
+        if result:
+            _lookup_cache[cache_key] = result
+            if len(_lookup_cache) > LOOKUP_CACHE_SIZE:
+                _lookup_cache.popitem(last=False)
+        return result if result else None
     except Exception as e:
-        logging.error(f"Ошибка при получении контактов: {e}")
+        logger.error(f"Ошибка при получении контактов: {e}")
         return None
 
+def get_contact_body_by_code(code: str):
+    """Получает текст контакта по коду.
+
+    Возвращает (найден ли код, текст); текст равен None для старых записей и контактов без текста.
+    """
+    try:
+        with metrics.timer("inline_lookup_latency"):
+            cursor = get_read_connection().execute("SELECT contact_body FROM users WHERE code = ?", (code,))
+            result = cursor.fetchone()
+            return (True, result[0]) if result else (False, None)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении текста контакта: {e}")
+        return False, None
+
 def save_img_path(code: str, img_path: str) -> str:
     """Сохраняет путь к изображению в базе данных для указанного кода."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE users SET img = ? WHERE code = ?", (img_path, code))
             conn.commit()
             if cursor.rowcount > 0:
-                logging.info(f"Путь к изображению для кода {code} обновлён.")
+                logger.info("Путь к изображению обновлён.", extra={"code": code})
                 return "Изображение успешно обработано."
             else:
-                logging.warning(f"Код {code} не найден.")
+                logger.warning("Код не найден.", extra={"code": code})
                 return f"Код {code} не найден в базе данных."
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при сохранении пути к изображению: {e}")
+        logger.error(f"Ошибка при сохранении пути к изображению: {e}")
         return "Произошла ошибка при сохранении изображения."
 
-def clear_table() -> str:
-    """Очищает таблицу users и удаляет все фотографии (кроме stock_image.png)."""
+def clear_table(idempotency_key: str = None) -> tuple:
+    """Очищает таблицу users и удаляет все фотографии (кроме stock_image.png).
+
+    Возвращает (результат, повтор), как add_user.
+    """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
+            stored = _get_idempotent_result(cursor, idempotency_key)
+            if stored is not None:
+                return stored, True
             cursor.execute("SELECT img FROM users")
             rows = cursor.fetchall()
 
-            # Удаляем все фотографии, кроме stock_image.png
+            # Ставим все фотографии, кроме stock_image.png, в очередь на удаление
             for row in rows:
-                img_path = row[0]
-                if img_path and img_path != EXCLUDED_IMAGE:
-                    delete_image(img_path)
+                enqueue_image_removal(row[0])
 
             cursor.execute("DELETE FROM users")
+            result = "Таблица users очищена, все фотографии (кроме stock_image.png) удалены."
+            _save_idempotent_result(cursor, idempotency_key, result)
             conn.commit()
-            logging.info("Таблица users очищена, все фотографии (кроме stock_image.png) удалены.")
-            return "Таблица users очищена, все фотографии (кроме stock_image.png) удалены."
+            invalidate_lookup_cache()
+            logger.info(result)
+            return result, False
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при очистке таблицы: {e}")
-        return "Произошла ошибка при очистке таблицы."
+        logger.error(f"Ошибка при очистке таблицы: {e}")
+        return "Произошла ошибка при очистке таблицы.", False
     
 def get_img_path_by_code(code: str) -> str:
     """Получает путь к изображению по коду."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT img FROM users WHERE code = ?", (code,))
             result = cursor.fetchone()
             if result:
-                logging.info(f"Путь к изображению для кода {code} найден: {result[0]}")
+                logger.debug("Путь к изображению найден: %s", result[0], extra={"code": code})
             else:
-                logging.info(f"Код {code} не найден в базе данных.")
+                logger.debug("Код не найден в базе данных.", extra={"code": code})
             return result[0] if result else None
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при получении пути к изображению: {e}")
+        logger.error(f"Ошибка при получении пути к изображению: {e}")
         return None
 
 def delete_image(img_path: str) -> str:
@@ -210,32 +432,253 @@ def delete_image(img_path: str) -> str:
     try:
         if os.path.exists(img_path):
             os.remove(img_path)
-            logging.info(f"Изображение {img_path} успешно удалено.")
+            logger.info("Изображение %s успешно удалено.", img_path)
             return f"Изображение {img_path} успешно удалено."
         else:
-            logging.warning(f"Изображение {img_path} не найдено.")
+            logger.warning("Изображение %s не найдено.", img_path)
             return f"Изображение {img_path} не найдено."
     except Exception as e:
-        logging.error(f"Ошибка при удалении изображения: {e}")
+        logger.error(f"Ошибка при удалении изображения: {e}")
         return f"Произошла ошибка при удалении изображения: {e}"
 
+def enqueue_image_removal(img_path: str) -> None:
+    """Ставит изображение в очередь на удаление фоновым сборщиком (кроме stock_image.png)."""
+    if img_path and os.path.basename(img_path) != EXCLUDED_IMAGE:
+        image_removal_queue.put(img_path)
+
+def get_img_paths_batch(after_id: int, limit: int) -> list:
+    """Возвращает пачку (user_id, img) с user_id > after_id для постраничного обхода таблицы.
+
+    Ошибки SQLite не перехватываются: пустой результат означает только конец таблицы.
+    """
+    with sqlite3.connect(get_database_path()) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_id, img FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_id, limit)
+        )
+        return cursor.fetchall()
+
+def create_file_ids_table():
+    """Создаёт таблицу file_id уже загруженных в Telegram изображений."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            # file_id действителен только для загрузившего его бота
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS image_file_ids (
+                    bot_id INTEGER NOT NULL,
+                    img TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    PRIMARY KEY (bot_id, img)
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблицы file_id: {e}")
+
+def save_file_ids(bot_id: int, rows: list) -> None:
+    """Сохраняет пары (img, file_id) для бота."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_file_ids (bot_id, img, file_id) VALUES (?, ?, ?)",
+                [(bot_id, img, file_id) for img, file_id in rows]
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении file_id: {e}")
+
+def get_code_images_batch(bot_id: int, after_id: int, limit: int) -> list:
+    """Возвращает пачку (user_id, code, img, file_id) записей с изображением для постраничного обхода."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT users.user_id, users.code, users.img, image_file_ids.file_id
+                FROM users
+                LEFT JOIN image_file_ids ON image_file_ids.img = users.img AND image_file_ids.bot_id = ?
+                WHERE users.user_id > ? AND users.img IS NOT NULL
+                ORDER BY users.user_id LIMIT ?
+            ''', (bot_id, after_id, limit))
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении изображений для экспорта: {e}")
+        return []
+
+def get_all_codes() -> list:
+    """Получает список всех занятых кодов."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT code FROM users")
+            return [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении списка кодов: {e}")
+        return []
+
 def get_all_codes_with_contacts():
     """Получает все коды и контактную информацию."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT code, contact_text, chat_id FROM users")
             return cursor.fetchall()
     except sqlite3.Error as e:
-        logging.error(f"Ошибка при получении всех контактов: {e}")
+        logger.error(f"Ошибка при получении всех контактов: {e}")
         return []
 
 
         
+def create_analytics_tables():
+    """Создаёт агрегированные таблицы статистики поиска, если они не существуют."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS code_stats (
+                    code TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hourly_stats (
+                    hour TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблиц статистики: {e}")
+
+def flush_lookup_stats(code_rows: list, hour_rows: list) -> None:
+    """Добавляет накопленные счётчики (ключ, попадания, промахи) одной транзакцией."""
+    with sqlite3.connect(get_database_path()) as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO code_stats (code, hits, misses) VALUES (?, ?, ?)
+            ON CONFLICT(code) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+        ''', code_rows)
+        cursor.executemany('''
+            INSERT INTO hourly_stats (hour, hits, misses) VALUES (?, ?, ?)
+            ON CONFLICT(hour) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+        ''', hour_rows)
+        conn.commit()
+
+def get_top_codes(limit: int = 10) -> list:
+    """Возвращает самые популярные коды: (code, hits, misses)."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT code, hits, misses FROM code_stats ORDER BY hits DESC LIMIT ?",
+                (limit,)
+            )
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении популярных кодов: {e}")
+        return []
+
+def get_hourly_totals(since_hour: str) -> tuple:
+    """Возвращает суммарные (попадания, промахи) начиная с указанного часа."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0) FROM hourly_stats WHERE hour >= ?",
+                (since_hour,)
+            )
+            return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении почасовой статистики: {e}")
+        return 0, 0
+
+def create_search_index():
+    """Создаёт полнотекстовый индекс FTS5 по кодам и тексту контактов и триггеры синхронизации с users."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(users_fts)")
+            columns = {row[1] for row in cursor.fetchall()}
+            index_exists = bool(columns)
+
+            # Первая версия индекса хранила contact_text (ID сообщения), а не текст контакта
+            if index_exists and "contact_body" not in columns:
+                for trigger in ("users_fts_insert", "users_fts_delete", "users_fts_update"):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                cursor.execute("DROP TABLE users_fts")
+                index_exists = False
+                logger.info("Полнотекстовый индекс пересоздаётся по тексту контактов.")
+
+            # Индекс префиксов позволяет искать коды по первым цифрам без полного перебора
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                    code, contact_body,
+                    content='users', content_rowid='user_id',
+                    prefix='1 2 3'
+                )
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+                    INSERT INTO users_fts(rowid, code, contact_body)
+                    VALUES (new.user_id, new.code, new.contact_body);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+                    INSERT INTO users_fts(users_fts, rowid, code, contact_body)
+                    VALUES ('delete', old.user_id, old.code, old.contact_body);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF code, contact_body ON users BEGIN
+                    INSERT INTO users_fts(users_fts, rowid, code, contact_body)
+                    VALUES ('delete', old.user_id, old.code, old.contact_body);
+                    INSERT INTO users_fts(rowid, code, contact_body)
+                    VALUES (new.user_id, new.code, new.contact_body);
+                END
+            ''')
+
+            # Заполняем индекс существующими записями при создании
+            if not index_exists:
+                cursor.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании полнотекстового индекса: {e}")
+
+def build_search_query(query: str) -> str:
+    """Преобразует ввод админа в безопасный запрос FTS5: каждое слово ищется по префиксу."""
+    tokens = [token.replace('"', '""') for token in query.split()]
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def search_contacts(query: str, limit: int, offset: int = 0) -> tuple:
+    """Ищет контакты по коду и тексту; возвращает (список (code, contact_body), всего найдено)."""
+    match = build_search_query(query)
+    if not match:
+        return [], 0
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM users_fts WHERE users_fts MATCH ?", (match,))
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT code, contact_body FROM users_fts WHERE users_fts MATCH ? "
+                "ORDER BY rank LIMIT ? OFFSET ?",
+                (match, limit, offset)
+            )
+            return cursor.fetchall(), total
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при поиске контактов: {e}")
+        return [], 0
+
 def get_message_id_by_code(code: str):
     """Получает contact_text по коду."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with sqlite3.connect(get_database_path()) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT contact_text FROM users WHERE code = ?",
@@ -244,11 +687,371 @@ def get_message_id_by_code(code: str):
             result = cursor.fetchone()
             return result[0] if result else None
     except Exception as e:
-        logging.error(f"Ошибка при получении contact_text: {e}")
+        logger.error(f"Ошибка при получении contact_text: {e}")
+        return None
+
+def create_acl_table(initial_admin_ids=()):
+    """Создаёт таблицу ролей (acl) и счётчик её изменений; пустая таблица заполняется начальными админами."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS acl (
+                    user_id INTEGER PRIMARY KEY,
+                    role TEXT NOT NULL CHECK (role IN ('admin', 'moderator')),
+                    granted_by INTEGER,
+                    granted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Версия увеличивается триггерами при любом изменении acl, в том числе из sqlite3 вручную
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS acl_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO acl_version (id, version) VALUES (0, 0)")
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS acl_{event.lower()}_version AFTER {event} ON acl BEGIN
+                        UPDATE acl_version SET version = version + 1 WHERE id = 0;
+                    END
+                ''')
+
+            cursor.execute("SELECT COUNT(*) FROM acl")
+            if cursor.fetchone()[0] == 0:
+                cursor.executemany(
+                    "INSERT INTO acl (user_id, role) VALUES (?, 'admin')",
+                    [(user_id,) for user_id in initial_admin_ids]
+                )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблицы ролей: {e}")
+
+def get_acl_version() -> int:
+    """Возвращает номер версии таблицы ролей (дешёвый запрос для проверки изменений)."""
+    cursor = get_read_connection().execute("SELECT version FROM acl_version WHERE id = 0")
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+def get_acl_entries() -> list:
+    """Возвращает все записи таблицы ролей: (user_id, role, granted_by, granted_at)."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, role, granted_by, granted_at FROM acl ORDER BY role, user_id")
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении списка ролей: {e}")
+        return []
+
+def _is_last_admin(cursor: sqlite3.Cursor, user_id: int) -> bool:
+    """Проверяет, что пользователь — единственный администратор в таблице acl."""
+    cursor.execute("SELECT role FROM acl WHERE user_id = ?", (user_id,))
+    result = cursor.fetchone()
+    if result is None or result[0] != "admin":
+        return False
+    cursor.execute("SELECT COUNT(*) FROM acl WHERE role = 'admin'")
+    return cursor.fetchone()[0] <= 1
+
+def set_user_role(user_id: int, role: str, granted_by: int, idempotency_key: str = None) -> str:
+    """Назначает пользователю роль (или меняет существующую); последнего админа понизить нельзя."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            stored = _get_idempotent_result(cursor, idempotency_key)
+            if stored is not None:
+                return stored
+            if role != "admin" and _is_last_admin(cursor, user_id):
+                return "Нельзя сменить роль последнего администратора."
+            cursor.execute('''
+                INSERT INTO acl (user_id, role, granted_by) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    role = excluded.role, granted_by = excluded.granted_by, granted_at = CURRENT_TIMESTAMP
+            ''', (user_id, role, granted_by))
+            result = f"Роль {role} успешно назначена пользователю {user_id}."
+            _save_idempotent_result(cursor, idempotency_key, result)
+            conn.commit()
+            return result
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при назначении роли: {e}")
+        return "Произошла ошибка при назначении роли."
+
+def remove_user_role(user_id: int, idempotency_key: str = None) -> str:
+    """Снимает роль с пользователя; последнего админа снять нельзя."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            stored = _get_idempotent_result(cursor, idempotency_key)
+            if stored is not None:
+                return stored
+            cursor.execute("SELECT 1 FROM acl WHERE user_id = ?", (user_id,))
+            if cursor.fetchone() is None:
+                return f"У пользователя {user_id} нет роли."
+            if _is_last_admin(cursor, user_id):
+                return "Нельзя снять роль с последнего администратора."
+            cursor.execute("DELETE FROM acl WHERE user_id = ?", (user_id,))
+            result = f"Роль пользователя {user_id} успешно снята."
+            _save_idempotent_result(cursor, idempotency_key, result)
+            conn.commit()
+            return result
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при снятии роли: {e}")
+        return "Произошла ошибка при снятии роли."
+
+def create_polling_state_tables():
+    """Создаёт таблицы состояния получения обновлений: сдвиг getUpdates, необработанные обновления и FSM."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS polling_offsets (
+                    bot_id INTEGER PRIMARY KEY,
+                    update_offset INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pending_updates (
+                    bot_id INTEGER NOT NULL,
+                    update_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (bot_id, update_id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    bot_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    destiny TEXT NOT NULL,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (bot_id, chat_id, user_id, destiny)
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблиц состояния обновлений: {e}")
+
+def get_polling_offset(bot_id: int):
+    """Возвращает сохранённый сдвиг getUpdates бота (None, если его нет)."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT update_offset FROM polling_offsets WHERE bot_id = ?", (bot_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении сдвига обновлений: {e}")
+        return None
+
+def save_polling_offset(bot_id: int, offset: int) -> None:
+    """Сохраняет сдвиг getUpdates бота."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.execute('''
+                INSERT INTO polling_offsets (bot_id, update_offset) VALUES (?, ?)
+                ON CONFLICT(bot_id) DO UPDATE SET update_offset = excluded.update_offset
+            ''', (bot_id, offset))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении сдвига обновлений: {e}")
+
+def save_pending_updates(rows: list) -> None:
+    """Сохраняет необработанные обновления (bot_id, update_id, JSON) для обработки после перезапуска."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pending_updates (bot_id, update_id, payload) VALUES (?, ?, ?)",
+                rows
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении необработанных обновлений: {e}")
+
+def take_pending_updates(bot_id: int) -> list:
+    """Забирает (и удаляет) сохранённые обновления бота в порядке update_id: [(update_id, JSON)]."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT update_id, payload FROM pending_updates WHERE bot_id = ? ORDER BY update_id",
+                (bot_id,)
+            )
+            rows = cursor.fetchall()
+            cursor.execute("DELETE FROM pending_updates WHERE bot_id = ?", (bot_id,))
+            conn.commit()
+            return rows
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении необработанных обновлений: {e}")
+        return []
+
+def create_user_activity_table():
+    """Создаёт в основной базе таблицу истории пользователей для защиты от перебора (load_shedding)."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_activity (
+                    user_id INTEGER PRIMARY KEY,
+                    first_seen REAL NOT NULL,
+                    last_hit REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблицы истории пользователей: {e}")
+
+def get_user_activity(user_id: int):
+    """Возвращает (впервые замечен, последнее попадание) пользователя в секундах Unix или None.
+
+    Таблица общая для всех ботов и всегда лежит в основной базе.
+    """
+    try:
+        with using_database(DATABASE_PATH):
+            cursor = get_read_connection().execute(
+                "SELECT first_seen, last_hit FROM user_activity WHERE user_id = ?", (user_id,)
+            )
+            return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении истории пользователя: {e}")
+        return None
+
+def save_user_activity(rows: list) -> None:
+    """Сохраняет историю пользователей (user_id, впервые замечен, последнее попадание) одной транзакцией."""
+    with sqlite3.connect(DATABASE_PATH) as conn:
+        conn.executemany('''
+            INSERT INTO user_activity (user_id, first_seen, last_hit) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                first_seen = min(first_seen, excluded.first_seen),
+                last_hit = max(last_hit, excluded.last_hit)
+        ''', rows)
+        conn.commit()
+
+def save_fsm_states(rows: list) -> None:
+    """Сохраняет состояния FSM при остановке: [(bot_id, chat_id, user_id, destiny, state, JSON данных)]."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.execute("DELETE FROM fsm_states")
+            conn.executemany(
+                "INSERT INTO fsm_states (bot_id, chat_id, user_id, destiny, state, data) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+
+def take_fsm_states() -> list:
+    """Забирает (и удаляет) состояния FSM, сохранённые при прошлой остановке."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT bot_id, chat_id, user_id, destiny, state, data FROM fsm_states")
+            rows = cursor.fetchall()
+            cursor.execute("DELETE FROM fsm_states")
+            conn.commit()
+            return rows
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении состояний FSM: {e}")
+        return []
+
+def configure_database():
+    """Включает журнал WAL и auto_vacuum = INCREMENTAL, с которыми работают задачи обслуживания.
+
+    Для существующей базы смена auto_vacuum требует однократного VACUUM (только при первом запуске).
+    """
+    check_and_create_db_folder()
+    try:
+        # VACUUM нельзя выполнять внутри транзакции, поэтому соединение без неявных транзакций
+        conn = sqlite3.connect(get_database_path(), isolation_level=None)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                logger.info("База данных переведена на инкрементальную очистку (auto_vacuum = INCREMENTAL).")
+            journal_mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if journal_mode.lower() != "wal":
+                logger.warning("Не удалось включить журнал WAL, режим журнала: %s", journal_mode)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при настройке базы данных: {e}")
+
+def checkpoint_wal():
+    """Переносит журнал WAL в файл базы и обрезает его; для других режимов журнала ничего не делает.
+
+    Возвращает (busy, страниц в журнале, перенесено страниц) или None.
+    """
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            if journal_mode.lower() != "wal":
+                return None
+            return conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании контрольной точки WAL: {e}")
         return None
 
+def optimize_database() -> None:
+    """Обновляет статистику планировщика запросов: полный ANALYZE в первый раз, дальше PRAGMA optimize."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            has_stats = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'"
+            ).fetchone() is not None
+            conn.execute("PRAGMA optimize" if has_stats else "ANALYZE")
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при обновлении статистики базы данных: {e}")
+
+def incremental_vacuum(pages: int) -> int:
+    """Возвращает ОС до pages свободных страниц (только при auto_vacuum = INCREMENTAL); возвращает их число."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() делает один шаг запроса и освобождает одну страницу; executescript доводит его до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при инкрементальной очистке базы данных: {e}")
+        return 0
+
+def create_idempotency_table():
+    """Создаёт таблицу ключей идемпотентности изменений, выполненных админами."""
+    check_and_create_db_folder()
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при создании таблицы ключей идемпотентности: {e}")
+
+def purge_idempotency_keys(max_age: int) -> int:
+    """Удаляет ключи идемпотентности старше max_age секунд; возвращает их количество."""
+    try:
+        with sqlite3.connect(get_database_path()) as conn:
+            cursor = conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+                (f"-{int(max_age)} seconds",)
+            )
+            conn.commit()
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при удалении старых ключей идемпотентности: {e}")
+        return 0
+
 
 
 
 if __name__ == "__main__":
-    create_database_and_table()
\ No newline at end of file
+    create_database_and_table()
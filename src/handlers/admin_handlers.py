@@ -1,43 +1,60 @@
 import os
 import re
+import asyncio
 
 
-from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext  
-from aiogram.types import FSInputFile
 
 from keyboards.keyboards import (
     get_admin_keyboard, get_moderation_keyboard,
     get_moderation_actions_keyboard, get_inline_back_button,
-    get_delete_keyboard, get_list_keyboard, get_start_keyboard
+    get_delete_keyboard, get_list_keyboard, get_start_keyboard,
+    get_code_input_keyboard, get_search_pagination_keyboard
 )
 from states.states import (
     ModerationStates, DeleteContactState, GetImageState,
     AddContactState
 )
 from utils import moderation, process_photo_with_code
+from contact_payload import snapshot_message
 from dp_manager import (
     add_user, delete_user_by_code, clear_table,
     save_img_path, get_all_codes_with_contacts,
-    get_img_path_by_code, get_message_id_by_code
+    get_img_path_by_code, get_message_id_by_code, search_contacts,
+    save_file_ids
 )
-from config import ALLOWED_USER_IDS, BOT_TOKEN
+from backup import get_database_backup
+from metrics import metrics
+from analytics import lookup_analytics
+from code_allocator import get_code_allocator
+from image_export import export_media_groups, build_images_zip
+from telegram_api import local_input_file, download_telegram_file
+from update_scheduler import shielded
+from codes import validate_code, normalize_code, CODE_FORMAT_HINT
+from texts import INVALID_CODE_TEXT, CHOOSE_ACTION_TEXT
+from acl import access_control, ROLE_ADMIN, ROLES, STAFF_ROLES
+from config import SEARCH_PAGE_SIZE
 import logging
 
 
 
 router = Router()
-bot = Bot(token=BOT_TOKEN)
 
-def validate_code(code: str) -> bool:
-    """Проверяет, что код состоит ровно из 4 цифр."""
-    return bool(code and code.isdigit() and len(code) == 4)
+# Фоновые задачи экспорта (ссылки держим, чтобы задачи не удалил сборщик мусора)
+export_tasks = set()
+
+def mutation_key(event) -> str:
+    """Ключ идемпотентности изменения: повторная доставка того же сообщения или нажатия даёт тот же ключ."""
+    if isinstance(event, CallbackQuery):
+        return f"{event.bot.id}:callback:{event.id}"
+    return f"{event.bot.id}:message:{event.chat.id}:{event.message_id}"
 
 @router.message(lambda message: message.text == "Меню")
-async def handle_menu(message: Message):
-    if message.from_user.id not in ALLOWED_USER_IDS:
+async def handle_menu(message: Message, role: str):
+    if role != ROLE_ADMIN:
         await message.answer("У вас нет прав для доступа к этому меню.")
         return
     
@@ -46,51 +63,255 @@ async def handle_menu(message: Message):
     await message.answer("Панель управления:", reply_markup=menu_kb)
     await message.answer("Используйте кнопку ниже для возврата в главное меню:", reply_markup=back_button)
 
+@router.message(Command("backup"))
+async def handle_backup(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    try:
+        name = await get_database_backup().create_snapshot()
+        await message.answer(f"✅ Снимок базы данных создан: {name}")
+    except Exception as e:
+        logging.error(f"Ошибка при создании снимка базы данных: {e}")
+        await message.answer("Произошла ошибка при создании снимка базы данных.")
+
+@router.message(Command("backups"))
+async def handle_backups_list(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    snapshots = get_database_backup().list_snapshots()
+    if not snapshots:
+        await message.answer("Снимков базы данных пока нет.")
+        return
+    await message.answer("💾 Снимки базы данных:\n\n" + "\n".join(snapshots))
+
+@router.message(Command("restore"))
+async def handle_restore(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Использование: /restore <имя снимка>")
+        return
+
+    try:
+        result = await get_database_backup().restore(parts[1].strip())
+        get_code_allocator().reset()
+        await message.answer(result)
+    except Exception as e:
+        logging.error(f"Ошибка при восстановлении базы данных: {e}")
+        await message.answer("Произошла ошибка при восстановлении базы данных.")
+
+@router.message(Command("metrics"))
+async def handle_metrics(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    await message.answer("📊 Метрики:\n\n" + metrics.format_report())
+
+@router.message(Command("stats"))
+async def handle_stats(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    try:
+        await message.answer(await lookup_analytics.report())
+    except Exception as e:
+        logging.error(f"Ошибка при получении статистики: {e}")
+        await message.answer("Произошла ошибка при получении статистики.")
+
+@router.message(Command("admins"))
+async def handle_admins_list(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    entries = access_control.list_entries()
+    if not entries:
+        await message.answer("Список ролей пуст.")
+        return
+    text = "🔑 Роли пользователей:\n\n"
+    for user_id, user_role, granted_by, granted_at in entries:
+        text += f"👤 ID: {user_id} — {user_role}"
+        if granted_by:
+            text += f" (выдал {granted_by}, {granted_at})"
+        text += "\n"
+    await message.answer(text)
+
+@router.message(Command("grant"))
+async def handle_grant(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = (message.text or "").split()
+    new_role = parts[2] if len(parts) > 2 else ROLE_ADMIN
+    if len(parts) < 2 or not parts[1].isdigit() or new_role not in ROLES:
+        await message.answer("Использование: /grant <ID пользователя> [admin|moderator]")
+        return
+
+    await message.answer(access_control.grant(
+        int(parts[1]), new_role, message.from_user.id, idempotency_key=mutation_key(message)
+    ))
+
+@router.message(Command("revoke"))
+async def handle_revoke(message: Message, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = (message.text or "").split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer("Использование: /revoke <ID пользователя>")
+        return
+
+    await message.answer(access_control.revoke(int(parts[1]), idempotency_key=mutation_key(message)))
+
+def format_search_page(query: str, page: int):
+    """Возвращает текст страницы результатов поиска и клавиатуру навигации."""
+    rows, total = search_contacts(query, SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE)
+    if not rows:
+        return f"🔍 По запросу «{query}» ничего не найдено.", get_inline_back_button()
+
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    text = f"🔍 Результаты по запросу «{query}» (стр. {page + 1} из {pages}, всего {total}):\n\n"
+    for code, contact_body in rows:
+        # Длинные контакты обрезаем, чтобы страница поместилась в одно сообщение
+        body = contact_body[:200] if contact_body else "(без текста)"
+        text += f"🔹 Код: {code}\n📝 Контакт: {body}\n\n"
+    keyboard = get_search_pagination_keyboard(page, page > 0, page + 1 < pages)
+    return text, keyboard
+
+@router.message(Command("search"))
+async def handle_search(message: Message, state: FSMContext, role: str):
+    if role != ROLE_ADMIN:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        await message.answer("Использование: /search <код или текст>")
+        return
+
+    query = parts[1].strip()
+    await state.update_data(search_query=query)
+    text, keyboard = format_search_page(query, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(lambda c: c.data and c.data.startswith("search_page:"))
+async def handle_search_page(callback: CallbackQuery, state: FSMContext, role: str):
+    if role != ROLE_ADMIN:
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Запрос устарел, выполните поиск заново.")
+        return
+
+    page = max(0, int(callback.data.split(":", 1)[1]))
+    text, keyboard = format_search_page(query, page)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
 @router.message(lambda message: message.text == "Добавить контакты")
-async def handle_add_contacts(message: Message, state: FSMContext):
-    if message.from_user.id not in ALLOWED_USER_IDS:
+async def handle_add_contacts(message: Message, state: FSMContext, role: str):
+    if role != ROLE_ADMIN:
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
     
     await state.set_state(AddContactState.waiting_for_code)
     await message.answer(
-        "Введите код для нового контакта:",
-        reply_markup=get_inline_back_button()
+        "Введите код для нового контакта или сгенерируйте свободный:",
+        reply_markup=get_code_input_keyboard()
     )
 
+@router.callback_query(AddContactState.waiting_for_code, lambda c: c.data == "generate_code")
+async def process_generate_code(callback: CallbackQuery, state: FSMContext):
+    code = get_code_allocator().allocate(callback.from_user.id)
+    if code is None:
+        await callback.message.answer(
+            "❌ Свободных кодов не осталось.",
+            reply_markup=get_inline_back_button()
+        )
+        await callback.answer()
+        return
+
+    await state.update_data(code=code)
+    await state.set_state(AddContactState.waiting_for_contact_info)
+    await callback.message.answer(f"Код {code} зарезервирован.\nТеперь отправьте контактную информацию:")
+    await callback.answer()
+
 @router.message(AddContactState.waiting_for_code)
 async def process_code(message: Message, state: FSMContext):
     if not message.text:
         await message.answer("Пожалуйста, введите код.")
         return
 
-    if not validate_code(message.text):
+    code = normalize_code(message.text)
+    if not validate_code(code):
         await message.answer(
-            "❌ Некорректный формат кода. Код должен состоять из 4 цифр.",
+            INVALID_CODE_TEXT,
             reply_markup=get_inline_back_button()
         )
         return
 
-    await state.update_data(code=message.text)
+    # Сразу резервируем код, чтобы админ узнал о занятости до ввода контакта
+    if not get_code_allocator().reserve(code, message.from_user.id):
+        await message.answer(
+            "Данный код занят, введите другой.",
+            reply_markup=get_code_input_keyboard()
+        )
+        return
+
+    await state.update_data(code=code)
     await state.set_state(AddContactState.waiting_for_contact_info)
     await message.answer("Теперь отправьте контактную информацию:")
 
 @router.message(AddContactState.waiting_for_contact_info)
 async def process_contact_info(message: Message, state: FSMContext):
-    if not message.text:
+    # Снимок текста, разметки и вложения: ответ пользователю собирается из него без copy_message
+    contact_payload = snapshot_message(message, message.bot.id)
+    if contact_payload is None:
         await message.answer("Пожалуйста, отправьте контактную информацию.")
         return
 
+    # Запись в БД, изображение и ответ не прерываются остановкой бота: повторная доставка
+    # обновления пропускает их (idempotency_key), поэтому выполнить их нужно до конца
+    await shielded(save_contact(message, state, contact_payload))
+
+async def save_contact(message: Message, state: FSMContext, contact_payload: str):
     try:
         data = await state.get_data()
         code = data.get('code')
 
-        # Сохраняем ID сообщения вместо текста
-        result = add_user(code, str(message.message_id), message.chat.id)
+        # ID сообщения сохраняется для запасного copy_message
+        result, replayed = add_user(
+            code, str(message.message_id), message.chat.id,
+            message.text or message.caption, contact_payload,
+            idempotency_key=mutation_key(message)
+        )
+        if replayed:
+            # Повторная доставка: контакт, изображение и ответ уже обработаны первой доставкой
+            await state.clear()
+            return
         if "успешно" not in result.lower():
+            if "занят" in result.lower():
+                # Код уже принадлежит другому контакту: он не должен вернуться в список свободных
+                get_code_allocator().commit(code)
+            else:
+                get_code_allocator().release(code)
             await message.answer(result, reply_markup=get_inline_back_button())
             await state.clear()
             return
+        get_code_allocator().commit(code)
 
         # Создаем изображение с кодом
         try:
@@ -100,12 +321,13 @@ async def process_contact_info(message: Message, state: FSMContext):
                 save_result = save_img_path(code, photo_path)
                 if "успешно" in save_result.lower():
                     # Отправляем изображение
-                    photo = FSInputFile(photo_path)
-                    await message.answer_photo(
+                    photo = local_input_file(photo_path)
+                    sent = await message.answer_photo(
                         photo=photo,
                         caption=f"✅ Контакт успешно добавлен!\nКод: {code}",
                         reply_markup=get_inline_back_button()
                     )
+                    save_file_ids(message.bot.id, [(photo_path, sent.photo[-1].file_id)])
                 else:
                     await message.answer(
                         f"✅ Контакт добавлен, но произошла ошибка при сохранении пути к изображению: {save_result}",
@@ -134,13 +356,13 @@ async def process_contact_info(message: Message, state: FSMContext):
 
     
 @router.message(lambda message: message.text == "Удалить контакты")
-async def handle_delete_contacts(message: Message):
-    if message.from_user.id not in ALLOWED_USER_IDS:
+async def handle_delete_contacts(message: Message, role: str):
+    if role != ROLE_ADMIN:
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
     
     await message.answer(
-        "Выберите действие:",
+        CHOOSE_ACTION_TEXT,
         reply_markup=get_delete_keyboard()
     )
 
@@ -151,13 +373,15 @@ async def handle_delete_by_code(callback_query: CallbackQuery, state: FSMContext
     await callback_query.answer()
 
 @router.callback_query(lambda c: c.data == "clear_database")
-async def handle_clear_database(callback_query: CallbackQuery):
-    if callback_query.from_user.id not in ALLOWED_USER_IDS:
+async def handle_clear_database(callback_query: CallbackQuery, role: str):
+    if role != ROLE_ADMIN:
         await callback_query.answer("У вас нет прав для выполнения этой команды.")
         return
     
-    clear_table()
-    await callback_query.message.answer("База данных очищена.")
+    _, replayed = clear_table(idempotency_key=mutation_key(callback_query))
+    if not replayed:
+        get_code_allocator().reset()
+        await callback_query.message.answer("База данных очищена.")
     await callback_query.answer()
 
 @router.message(DeleteContactState.waiting_for_code)
@@ -166,15 +390,19 @@ async def process_delete_customer(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, введите код.")
         return
 
-    if not validate_code(message.text):
+    code = normalize_code(message.text)
+    if not validate_code(code):
         await message.answer(
-            "❌ Некорректный формат кода. Код должен состоять из 4 цифр.",
+            INVALID_CODE_TEXT,
             reply_markup=get_inline_back_button()
         )
         return
 
-    result = delete_user_by_code(message.text)
-    await message.answer(result, reply_markup=get_inline_back_button())
+    result, replayed = delete_user_by_code(code, idempotency_key=mutation_key(message))
+    if not replayed:
+        if "удалены" in result:
+            get_code_allocator().release(code)
+        await message.answer(result, reply_markup=get_inline_back_button())
     await state.clear()
 
 @router.message(lambda message: message.text == "Список")
@@ -220,7 +448,7 @@ async def handle_list(message: Message):
 
 @router.callback_query(lambda c: c.data == "get_image")
 async def process_get_image(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("Введите код изображения (4 цифры):")
+    await callback.message.answer(f"Введите код изображения ({CODE_FORMAT_HINT}):")
     await state.set_state(GetImageState.waiting_for_code)
     await callback.answer()
 
@@ -230,20 +458,20 @@ async def process_image_code(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, введите код.")
         return
 
-    if not validate_code(message.text):
+    code = normalize_code(message.text)
+    if not validate_code(code):
         await message.answer(
-            "❌ Некорректный формат кода. Код должен состоять из 4 цифр.",
+            INVALID_CODE_TEXT,
             reply_markup=get_inline_back_button()
         )
         return
 
-    code = message.text
     try:
         # Получаем путь к изображению по коду
         img_path = get_img_path_by_code(code)
         if img_path and os.path.isfile(img_path):
             # Отправляем только изображение
-            photo = FSInputFile(img_path)
+            photo = local_input_file(img_path)
             await message.answer_photo(
                 photo=photo,
                 caption=f"🎯 Изображение для кода: {code}",
@@ -265,9 +493,50 @@ async def process_image_code(message: Message, state: FSMContext):
 
 
 
+async def run_export(callback: CallbackQuery, as_zip: bool):
+    """Выполняет экспорт изображений и сообщает админу результат."""
+    chat_id = callback.message.chat.id
+    bot = callback.bot
+    try:
+        if as_zip:
+            archive_path, count = await build_images_zip(bot.id)
+            try:
+                if count:
+                    await bot.send_document(
+                        chat_id, FSInputFile(archive_path, filename="codes.zip"),
+                        caption=f"🗜 Архив изображений: {count} шт."
+                    )
+                else:
+                    await bot.send_message(chat_id, "Изображений для экспорта нет.")
+            finally:
+                os.remove(archive_path)
+        else:
+            count = await export_media_groups(bot, chat_id)
+            await bot.send_message(
+                chat_id,
+                f"✅ Выгружено изображений: {count}" if count else "Изображений для экспорта нет.",
+                reply_markup=get_inline_back_button()
+            )
+    except Exception as e:
+        logging.error(f"Ошибка при экспорте изображений: {e}")
+        await bot.send_message(chat_id, "Произошла ошибка при экспорте изображений.")
+
+@router.callback_query(lambda c: c.data in ("export_images", "export_zip"))
+async def handle_export_images(callback: CallbackQuery, role: str):
+    if role != ROLE_ADMIN:
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    # Экспорт может идти минутами, поэтому не занимаем им обработчик обновлений
+    task = asyncio.create_task(run_export(callback, as_zip=callback.data == "export_zip"))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
+    await callback.message.answer("⏳ Экспорт изображений запущен, это может занять некоторое время.")
+    await callback.answer()
+
 @router.message(lambda message: message.photo)
-async def handle_photo(message: Message, state: FSMContext):
-    if message.from_user.id not in ALLOWED_USER_IDS:
+async def handle_photo(message: Message, state: FSMContext, role: str):
+    if role != ROLE_ADMIN:
         return
     
     state_data = await state.get_data()
@@ -283,7 +552,7 @@ async def handle_photo(message: Message, state: FSMContext):
         file = await message.bot.get_file(file_id)
         file_path = file.file_path
         
-        downloaded_file = await message.bot.download_file(file_path)
+        downloaded_file = await download_telegram_file(message.bot, file_path)
         img_path = None
         save_img_path(code, img_path)
         
@@ -295,12 +564,12 @@ async def handle_photo(message: Message, state: FSMContext):
         await state.clear()
 
 @router.callback_query(lambda c: c.data == "back_to_main")
-async def process_back_to_main(callback_query: CallbackQuery, state: FSMContext):
+async def process_back_to_main(callback_query: CallbackQuery, state: FSMContext, role: str):
     if callback_query.message is None:
         return
     await state.clear()
-    keyboard = get_start_keyboard(callback_query.from_user.id, ALLOWED_USER_IDS)
-    await callback_query.message.answer("Выберите действие:", reply_markup=keyboard)
+    keyboard = get_start_keyboard(role)
+    await callback_query.message.answer(CHOOSE_ACTION_TEXT, reply_markup=keyboard)
     await callback_query.message.delete()
     await callback_query.answer()
 
@@ -308,7 +577,7 @@ async def process_back_to_main(callback_query: CallbackQuery, state: FSMContext)
 
 
 # Обработчики для модерации
-@router.message(lambda message: message.text == "👮‍♂️ Модерация" and message.from_user.id in ALLOWED_USER_IDS)
+@router.message(lambda message, role: message.text == "👮‍♂️ Модерация" and role in STAFF_ROLES)
 async def handle_moderation_menu(message: Message):
     await message.answer(
         "👮‍♂️ Панель модерации\n\n"
@@ -317,7 +586,11 @@ async def handle_moderation_menu(message: Message):
     )
 
 @router.callback_query(lambda c: c.data == "unmute_by_id")
-async def handle_unmute_request(callback: CallbackQuery, state: FSMContext):
+async def handle_unmute_request(callback: CallbackQuery, state: FSMContext, role: str):
+    if role not in STAFF_ROLES:
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+
     await callback.message.answer(
         "🆔 Введите ID пользователя для снятия ограничений:",
         reply_markup=get_inline_back_button()
@@ -348,7 +621,11 @@ async def process_unmute_user(message: Message, state: FSMContext):
     await state.clear()
 
 @router.callback_query(lambda c: c.data == "muted_list")
-async def handle_muted_list(callback: CallbackQuery):
+async def handle_muted_list(callback: CallbackQuery, role: str):
+    if role not in STAFF_ROLES:
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+
     muted_users = moderation.get_muted_users()
     
     if not muted_users:
@@ -376,7 +653,7 @@ async def handle_muted_list(callback: CallbackQuery):
     await callback.answer()
 
 # Существующие обработчики админ-панели
-@router.message(lambda message: message.text == "Меню" and message.from_user.id in ALLOWED_USER_IDS)
+@router.message(lambda message, role: message.text == "Меню" and role == ROLE_ADMIN)
 async def admin_menu(message: Message):
     await message.answer(
         "Панель администратора.\nВыберите действие:",
@@ -387,7 +664,7 @@ async def admin_menu(message: Message):
 async def handle_back_to_main(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer(
-        "Выберите действие:",
+        CHOOSE_ACTION_TEXT,
         reply_markup=get_admin_keyboard()
     )
     await callback.answer()
\ No newline at end of file
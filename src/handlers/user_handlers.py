@@ -1,6 +1,11 @@
 from aiogram import Router, Bot
-from aiogram.types import Message, FSInputFile, CallbackQuery
-from aiogram.filters import Command
+from aiogram.types import (
+    Message, FSInputFile, CallbackQuery, InlineQuery,
+    InlineQueryResultArticle, InputTextMessageContent,
+    InlineKeyboardMarkup, InlineKeyboardButton
+)
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
 from keyboards.keyboards import (
@@ -8,28 +13,40 @@ from keyboards.keyboards import (
     get_help_keyboard, get_list_keyboard
 )
 from states.states import EnterCodeState
-from dp_manager import get_contacts_by_code, get_img_path_by_code
+from dp_manager import get_contacts_by_code, get_img_path_by_code, get_contact_body_by_code
 from utils import moderation
-from config import ALLOWED_USER_IDS, BOT_TOKEN
+from contact_payload import can_send_locally, send_contact_payload
+from analytics import lookup_analytics
+from load_shedding import load_shedder, ADMIT, REJECT, DELAY
+from codes import validate_code, normalize_code
+from texts import (
+    START_TEXT, HELP_TEXT, ENTER_CODE_TEXT, INVALID_CODE_TEXT,
+    CHOOSE_ACTION_TEXT, UNKNOWN_MESSAGE_TEXT
+)
+from config import INLINE_CACHE_TIME, INLINE_MISS_CACHE_TIME
 import os
+import re
+import time
 import logging
 
+logger = logging.getLogger(__name__)
+
 router = Router()
-bot = Bot(token=BOT_TOKEN)
 
-def validate_code(code: str) -> bool:
-    """Проверяет, что код состоит ровно из 4 цифр."""
-    return bool(code and code.isdigit() and len(code) == 4)
+# Параметр /start из ссылки inline-режима: t.me/<бот>?start=code_<код>
+CODE_DEEP_LINK_PREFIX = "code_"
+# Допустимые символы параметра /start по правилам Telegram
+DEEP_LINK_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
 
 @router.message(Command("start"))
-async def cmd_start(message: Message):
-    keyboard = get_start_keyboard(message.from_user.id, ALLOWED_USER_IDS)
-    await message.answer(
-        "👋 Добро пожаловать!\n\n"
-        "🔍 Для поиска информации используйте кнопку «Ввести код»\n"
-        "❓ Если у вас возникли вопросы, нажмите «Помощь»",
-        reply_markup=keyboard
-    )
+async def cmd_start(message: Message, command: CommandObject, state: FSMContext, role: str):
+    # Переход по ссылке из inline-режима сразу ищет код
+    if command.args and command.args.startswith(CODE_DEEP_LINK_PREFIX):
+        await lookup_code(message, state, command.args[len(CODE_DEEP_LINK_PREFIX):])
+        return
+
+    keyboard = get_start_keyboard(role)
+    await message.answer(START_TEXT, reply_markup=keyboard)
 
 @router.message(lambda message: message.text == "Ввести код")
 async def handle_enter_code(message: Message, state: FSMContext):
@@ -39,7 +56,7 @@ async def handle_enter_code(message: Message, state: FSMContext):
 
     await state.set_state(EnterCodeState.waiting_for_code)
     await message.answer(
-        "🔢 Введите 4-значный код:",
+        ENTER_CODE_TEXT,
         reply_markup=get_inline_back_button()
     )
 
@@ -49,11 +66,25 @@ async def process_code_input(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, введите код.")
         return
 
+    await lookup_code(message, state, message.text)
+
+async def lookup_code(message: Message, state: FSMContext, text: str):
+    """Ищет код из ввода пользователя или ссылки /start и отправляет контакт."""
     # Проверяем, не в муте ли пользователь
     if moderation.is_muted(message.from_user.id):
         return
 
-    if not validate_code(message.text):
+    # В защищённом режиме отсекаем перебор до любой работы с кодом и БД
+    verdict, retry_after = load_shedder.admit(message.from_user.id)
+    if verdict == REJECT:
+        return
+    if verdict == DELAY:
+        await message.answer(f"⏳ Слишком много запросов. Повторите через {int(retry_after) + 1} с.")
+        return
+
+    code = normalize_code(text)
+    if not validate_code(code):
+        load_shedder.record(message.from_user.id, None, hit=False)
         # Увеличиваем счетчик неудачных попыток
         should_mute, attempts_left = moderation.increment_attempts(message.from_user.id)
         
@@ -69,15 +100,21 @@ async def process_code_input(message: Message, state: FSMContext):
             return
         else:
             await message.answer(
-                f"❌ Некорректный формат кода. Код должен состоять из 4 цифр.\n"
+                f"{INVALID_CODE_TEXT}\n"
                 f"⚠️ Осталось попыток: {attempts_left}",
                 reply_markup=get_inline_back_button()
             )
             return
 
-    code = message.text
+    started = time.perf_counter()
     try:
         contact_data = get_contacts_by_code(code)
+        lookup_analytics.record(code, hit=bool(contact_data))
+        load_shedder.record(message.from_user.id, code, hit=bool(contact_data))
+        logger.debug(
+            "Поиск кода: %s", "найден" if contact_data else "не найден",
+            extra={"code": code, "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+        )
         if not contact_data:
             # Увеличиваем счетчик неудачных попыток при неверном коде
             should_mute, attempts_left = moderation.increment_attempts(message.from_user.id)
@@ -104,55 +141,114 @@ async def process_code_input(message: Message, state: FSMContext):
         if message.from_user.id in moderation.muted_users:
             moderation.muted_users[message.from_user.id]["attempts"] = 0
 
-        message_id, chat_id = contact_data
-        # Копируем оригинальное сообщение
-        await bot.copy_message(
-            chat_id=message.chat.id,
-            from_chat_id=chat_id,
-            message_id=int(message_id),
-            reply_markup=get_inline_back_button()
-        )
+        await send_contact(message.bot, message.chat.id, contact_data)
         
         await state.clear()
         
     except Exception as e:
-        logging.error(f"Error processing code {code}: {e}")
+        logger.error("Error processing code: %s", e, extra={"code": code})
         await message.answer(
             "❌ Произошла ошибка при обработке кода. Пожалуйста, попробуйте позже.",
             reply_markup=get_inline_back_button()
         )
         await state.clear()
 
+async def send_contact(bot: Bot, chat_id: int, contact_data) -> None:
+    """Отправляет контакт из сохранённого снимка; старые записи без снимка копируются из чата админа."""
+    message_id, from_chat_id, contact_payload = contact_data
+    if can_send_locally(contact_payload, bot.id):
+        try:
+            await send_contact_payload(bot, chat_id, contact_payload, reply_markup=get_inline_back_button())
+            return
+        except TelegramBadRequest as e:
+            # Например, file_id стал недействителен — пробуем исходное сообщение
+            logger.warning("Не удалось отправить снимок контакта: %s", e)
+    await bot.copy_message(
+        chat_id=chat_id,
+        from_chat_id=from_chat_id,
+        message_id=int(message_id),
+        reply_markup=get_inline_back_button()
+    )
+
+@router.inline_query()
+async def handle_inline_code(inline_query: InlineQuery):
+    """Поиск по коду в inline-режиме (@bot 1234) без FSM и copy_message."""
+    code = normalize_code(inline_query.query)
+    user_id = inline_query.from_user.id
+
+    # Неполный ввод и замученные пользователи получают пустой ответ с коротким личным кэшем
+    if moderation.is_muted(user_id) or not validate_code(code):
+        await inline_query.answer([], cache_time=INLINE_MISS_CACHE_TIME, is_personal=True)
+        return
+
+    if load_shedder.admit(user_id)[0] != ADMIT:
+        await inline_query.answer([], cache_time=INLINE_MISS_CACHE_TIME, is_personal=True)
+        return
+
+    found, contact_body = get_contact_body_by_code(code)
+    lookup_analytics.record(code, hit=found)
+    load_shedder.record(user_id, code, hit=found)
+    if not found:
+        # Промахи учитываются так же, как в обычном поиске, чтобы inline не обходил модерацию
+        should_mute, _ = moderation.increment_attempts(user_id)
+        if should_mute:
+            moderation.mute_user(user_id)
+        await inline_query.answer([], cache_time=INLINE_MISS_CACHE_TIME, is_personal=True)
+        return
+
+    if user_id in moderation.muted_users:
+        moderation.muted_users[user_id]["attempts"] = 0
+
+    if not contact_body:
+        # Код существует, но текста для inline нет (старая запись или только вложение): ведём в бота
+        start_parameter = f"{CODE_DEEP_LINK_PREFIX}{code}"
+        if not DEEP_LINK_PATTERN.fullmatch(start_parameter):
+            await inline_query.answer([], cache_time=INLINE_MISS_CACHE_TIME, is_personal=True)
+            return
+        me = await inline_query.bot.me()
+        result = InlineQueryResultArticle(
+            id=code,
+            title=f"Код {code}",
+            description="Контакт доступен в боте",
+            input_message_content=InputTextMessageContent(
+                message_text=f"Контакт по коду {code} доступен в боте."
+            ),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+                text="Открыть в боте", url=f"https://t.me/{me.username}?start={start_parameter}"
+            )]])
+        )
+        await inline_query.answer([result], cache_time=INLINE_CACHE_TIME, is_personal=False)
+        return
+
+    result = InlineQueryResultArticle(
+        id=code,
+        title=f"Код {code}",
+        description=contact_body[:100],
+        input_message_content=InputTextMessageContent(message_text=contact_body)
+    )
+    # Ответ одинаков для всех, поэтому Telegram может отдавать его из общего кэша
+    await inline_query.answer([result], cache_time=INLINE_CACHE_TIME, is_personal=False)
+
 @router.message(lambda message: message.text == "Помощь")
 async def handle_help(message: Message):
     # Проверяем, не в муте ли пользователь
     if moderation.is_muted(message.from_user.id):
         return
 
-    help_text = """
-ℹ️ Помощь по использованию бота:
-
-1️⃣ Для поиска информации нажмите кнопку «Ввести код» и введите 4-значный код
-2️⃣ После ввода кода вы получите всю доступную информацию
-3️⃣ Если у вас возникли вопросы или проблемы, воспользуйтесь кнопкой связи с поддержкой 👇
-"""
-    await message.answer(help_text, reply_markup=get_help_keyboard())
+    await message.answer(HELP_TEXT, reply_markup=get_help_keyboard())
 
 @router.callback_query(lambda c: c.data == "back_to_main")
-async def process_back_to_main(callback: CallbackQuery, state: FSMContext):
+async def process_back_to_main(callback: CallbackQuery, state: FSMContext, role: str):
     await state.clear()
-    keyboard = get_start_keyboard(callback.from_user.id, ALLOWED_USER_IDS)
-    await callback.message.answer("Выберите действие:", reply_markup=keyboard)
+    keyboard = get_start_keyboard(role)
+    await callback.message.answer(CHOOSE_ACTION_TEXT, reply_markup=keyboard)
     await callback.answer()
 
 @router.message()
-async def handle_unknown_message(message: Message):
+async def handle_unknown_message(message: Message, role: str):
     # Проверяем, не в муте ли пользователь
     if moderation.is_muted(message.from_user.id):
         return
 
-    keyboard = get_start_keyboard(message.from_user.id, ALLOWED_USER_IDS)
-    await message.answer(
-        "❓ Пожалуйста, используйте доступные команды из меню:",
-        reply_markup=keyboard
-    )
\ No newline at end of file
+    keyboard = get_start_keyboard(role)
+    await message.answer(UNKNOWN_MESSAGE_TEXT, reply_markup=keyboard)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import zipfile
+import tempfile
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InputMediaPhoto
+
+from config import TEMP_IMAGES_PATH, EXPORT_GROUP_INTERVAL, EXPORT_BATCH_SIZE
+from dp_manager import get_code_images_batch, save_file_ids
+from telegram_api import local_input_file
+
+# Максимум фотографий в одном альбоме sendMediaGroup
+MEDIA_GROUP_SIZE = 10
+
+
+async def iter_code_images(bot_id: int, batch_size: int = EXPORT_BATCH_SIZE):
+    """Постранично выдаёт (code, img, file_id) для всех записей с изображением."""
+    last_id = 0
+    while True:
+        rows = await asyncio.to_thread(get_code_images_batch, bot_id, last_id, batch_size)
+        if not rows:
+            return
+        for user_id, code, img, file_id in rows:
+            # Ранее загруженное изображение отправляется по file_id, даже если файла уже нет
+            if file_id or os.path.isfile(img):
+                yield code, img, file_id
+        last_id = rows[-1][0]
+
+
+async def _send_group(bot: Bot, chat_id: int, group: list) -> None:
+    """Отправляет один альбом, повторяя попытку после ограничения частоты.
+
+    sendMediaGroup принимает от 2 до 10 фото, поэтому одиночное фото отправляется через sendPhoto.
+    """
+    media = [
+        InputMediaPhoto(media=file_id or local_input_file(img), caption=f"Код: {code}")
+        for code, img, file_id in group
+    ]
+    while True:
+        try:
+            if len(media) == 1:
+                messages = [await bot.send_photo(chat_id=chat_id, photo=media[0].media, caption=media[0].caption)]
+            else:
+                messages = await bot.send_media_group(chat_id=chat_id, media=media)
+            break
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+    # Запоминаем file_id новых загрузок, чтобы в следующий раз не загружать файлы повторно
+    uploaded = [
+        (img, sent.photo[-1].file_id)
+        for (code, img, file_id), sent in zip(group, messages)
+        if not file_id and sent.photo
+    ]
+    if uploaded:
+        await asyncio.to_thread(save_file_ids, bot.id, uploaded)
+
+
+async def export_media_groups(bot: Bot, chat_id: int) -> int:
+    """Отправляет все изображения кодов альбомами по 10 и возвращает их количество."""
+    group = []
+    sent = 0
+    async for item in iter_code_images(bot.id):
+        group.append(item)
+        if len(group) == MEDIA_GROUP_SIZE:
+            if sent:
+                await asyncio.sleep(EXPORT_GROUP_INTERVAL)
+            await _send_group(bot, chat_id, group)
+            sent += len(group)
+            group = []
+    if group:
+        if sent:
+            await asyncio.sleep(EXPORT_GROUP_INTERVAL)
+        await _send_group(bot, chat_id, group)
+        sent += len(group)
+    return sent
+
+
+async def build_images_zip(bot_id: int) -> tuple:
+    """Собирает ZIP-архив всех изображений во временном файле; возвращает (путь, количество)."""
+    fd, archive_path = tempfile.mkstemp(prefix="codes_", suffix=".zip", dir=TEMP_IMAGES_PATH)
+    os.close(fd)
+    count = 0
+    try:
+        # Архив дописывается пачками, в памяти держится только текущая пачка путей
+        batch = []
+        await asyncio.to_thread(_append_zip, archive_path, [], "w")
+        async for code, img, _ in iter_code_images(bot_id):
+            if not os.path.isfile(img):
+                continue
+            batch.append((code, img))
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                await asyncio.to_thread(_append_zip, archive_path, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(_append_zip, archive_path, batch)
+            count += len(batch)
+    except Exception:
+        os.remove(archive_path)
+        raise
+    return archive_path, count
+
+
+def _append_zip(archive_path: str, items: list, mode: str = "a") -> None:
+    """Дописывает файлы в архив; файлы читаются с диска по частям, PNG хранятся без сжатия."""
+    with zipfile.ZipFile(archive_path, mode, compression=zipfile.ZIP_STORED) as archive:
+        for code, img in items:
+            archive.write(img, arcname=f"{code}{os.path.splitext(img)[1]}")
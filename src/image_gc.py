@@ -0,0 +1,127 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import sqlite3
+
+from config import (
+    IMAGES_PATH, ALL_DATABASE_PATHS, render_images_dir,
+    IMAGE_GC_SCAN_INTERVAL, IMAGE_GC_DRAIN_INTERVAL, IMAGE_GC_BATCH_SIZE,
+    IMAGE_GC_CONCURRENCY, IMAGE_GC_MIN_AGE
+)
+from dp_manager import (
+    EXCLUDED_IMAGE, image_removal_queue, get_img_paths_batch, delete_image, using_database
+)
+
+# Расширения файлов, которые считаются изображениями
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+# Директории, которые сверяются со столбцом img (включая папки изображений всех баз контактов)
+GC_DIRECTORIES = list(dict.fromkeys(
+    [IMAGES_PATH] + [render_images_dir(database_path) for database_path in ALL_DATABASE_PATHS]
+))
+
+
+class ImageGarbageCollector:
+    """Фоновое удаление изображений: очередь удалений от админов и поиск файлов-сирот."""
+
+    def __init__(self, directories=None, batch_size: int = IMAGE_GC_BATCH_SIZE,
+                 max_concurrency: int = IMAGE_GC_CONCURRENCY,
+                 scan_interval: float = IMAGE_GC_SCAN_INTERVAL,
+                 drain_interval: float = IMAGE_GC_DRAIN_INTERVAL,
+                 min_age: float = IMAGE_GC_MIN_AGE):
+        self.directories = directories or GC_DIRECTORIES
+        self.batch_size = batch_size
+        self.scan_interval = scan_interval
+        self.drain_interval = drain_interval
+        self.min_age = min_age
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _remove(self, img_path: str) -> None:
+        """Удаляет файл в отдельном потоке, ограничивая число одновременных операций."""
+        async with self._semaphore:
+            await asyncio.to_thread(delete_image, img_path)
+
+    async def _remove_many(self, paths) -> int:
+        paths = list(paths)
+        if paths:
+            await asyncio.gather(*(self._remove(path) for path in paths))
+        return len(paths)
+
+    async def drain_queue(self) -> int:
+        """Удаляет все файлы, поставленные в очередь из dp_manager."""
+        paths = set()
+        while True:
+            try:
+                paths.add(image_removal_queue.get_nowait())
+            except queue.Empty:
+                break
+        return await self._remove_many(paths)
+
+    def _scan_directories(self) -> set:
+        """Собирает файлы-кандидаты через os.scandir (без stock_image.png и свежих файлов)."""
+        candidates = set()
+        deadline = time.time() - self.min_age
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name == EXCLUDED_IMAGE:
+                        continue
+                    if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    # Свежий файл может принадлежать ещё не сохранённому контакту
+                    if entry.stat().st_mtime > deadline:
+                        continue
+                    candidates.add(os.path.abspath(entry.path))
+        return candidates
+
+    async def collect_orphans(self) -> int:
+        """Удаляет файлы, на которые не ссылается ни одна строка users ни в одной базе контактов."""
+        candidates = await asyncio.to_thread(self._scan_directories)
+        if not candidates:
+            return 0
+
+        # Каталоги изображений общие для всех ботов, поэтому сверяем со всеми базами
+        try:
+            for database_path in ALL_DATABASE_PATHS:
+                with using_database(database_path):
+                    await self._discard_referenced(candidates)
+        except sqlite3.Error as e:
+            # Без полного списка ссылок нельзя отличить сироту от используемого файла
+            logging.error(f"Поиск файлов-сирот прерван, ничего не удалено: {e}")
+            return 0
+
+        removed = await self._remove_many(candidates)
+        if removed:
+            logging.info(f"Сборщик изображений удалил файлов-сирот: {removed}")
+        return removed
+
+    async def _discard_referenced(self, candidates: set) -> None:
+        """Убирает из кандидатов файлы, на которые ссылается текущая база (пачками по batch_size)."""
+        last_id = 0
+        while candidates:
+            rows = await asyncio.to_thread(get_img_paths_batch, last_id, self.batch_size)
+            if not rows:
+                break
+            for user_id, img_path in rows:
+                if img_path:
+                    candidates.discard(os.path.abspath(img_path))
+            last_id = rows[-1][0]
+
+    async def run(self) -> None:
+        """Основной цикл: часто разбирает очередь и периодически ищет файлы-сироты."""
+        next_scan = time.monotonic()
+        while True:
+            try:
+                await self.drain_queue()
+                if time.monotonic() >= next_scan:
+                    await self.collect_orphans()
+                    next_scan = time.monotonic() + self.scan_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка в сборщике изображений: {e}")
+            await asyncio.sleep(self.drain_interval)
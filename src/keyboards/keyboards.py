@@ -1,17 +1,23 @@
+from functools import lru_cache
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
-def get_start_keyboard(user_id: int, allowed_user_ids: list) -> ReplyKeyboardMarkup:
+# Клавиатуры строятся один раз и переиспользуются во всех ответах (lru_cache).
+# Возвращаемые объекты общие — изменять их нельзя.
+
+@lru_cache(maxsize=None)
+def get_start_keyboard(role: str = None) -> ReplyKeyboardMarkup:
     kb = [
         [KeyboardButton(text="Ввести код")],
         [KeyboardButton(text="Помощь")]
     ]
-    if user_id in allowed_user_ids:
-        kb.extend([
-            [KeyboardButton(text="Меню")],
-            [KeyboardButton(text="👮‍♂️ Модерация")]
-        ])
+    if role == "admin":
+        kb.append([KeyboardButton(text="Меню")])
+    if role in ("admin", "moderator"):
+        kb.append([KeyboardButton(text="👮‍♂️ Модерация")])
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_inline_back_button() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -20,15 +26,37 @@ def get_inline_back_button() -> InlineKeyboardMarkup:
     )
     return keyboard
 
+@lru_cache(maxsize=None)
+def get_code_input_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎲 Сгенерировать код", callback_data="generate_code")],
+        [InlineKeyboardButton(text="🔙 Вернуться в главное меню", callback_data="back_to_main")]
+    ])
+
+@lru_cache(maxsize=None)
 def get_list_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="📸 Получить изображение по коду", callback_data="get_image")],
+            [InlineKeyboardButton(text="🖼 Выгрузить все изображения", callback_data="export_images")],
+            [InlineKeyboardButton(text="🗜 Архив всех изображений", callback_data="export_zip")],
             [InlineKeyboardButton(text="🔙 Вернуться в главное меню", callback_data="back_to_main")]
         ]
     )
     return keyboard
 
+@lru_cache(maxsize=256)
+def get_search_pagination_keyboard(page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"search_page:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"search_page:{page + 1}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(text="🔙 Вернуться в главное меню", callback_data="back_to_main")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@lru_cache(maxsize=None)
 def get_admin_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -40,6 +68,7 @@ def get_admin_keyboard() -> ReplyKeyboardMarkup:
         resize_keyboard=True
     )
 
+@lru_cache(maxsize=None)
 def get_delete_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🗑 Удалить по коду", callback_data="delete_by_code")],
@@ -47,6 +76,7 @@ def get_delete_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 Вернуться в главное меню", callback_data="back_to_main")]
     ])
 
+@lru_cache(maxsize=None)
 def get_help_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
@@ -55,6 +85,7 @@ def get_help_keyboard() -> InlineKeyboardMarkup:
         )]
     ])
 
+@lru_cache(maxsize=None)
 def get_moderation_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -64,6 +95,7 @@ def get_moderation_keyboard() -> ReplyKeyboardMarkup:
         resize_keyboard=True
     )
 
+@lru_cache(maxsize=None)
 def get_moderation_actions_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔓 Размутить по ID", callback_data="unmute_by_id")],
@@ -0,0 +1,190 @@
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+
+from config import (
+    SHED_ENABLED, SHED_WINDOW, SHED_MISS_THRESHOLD, SHED_MISS_RATIO, SHED_CODE_MISS_THRESHOLD,
+    SHED_COOLDOWN, SHED_MIN_USER_AGE, SHED_BASE_DELAY, SHED_MAX_DELAY, SHED_MAX_USERS, SHED_FLUSH_INTERVAL
+)
+from metrics import metrics
+from dp_manager import get_user_activity, save_user_activity
+
+logger = logging.getLogger(__name__)
+
+# Решения admit()
+ADMIT = "admit"  # Поиск выполняется как обычно
+REJECT = "reject"  # Новый пользователь в защищённом режиме: отказ без ответа и без работы с БД
+DELAY = "delay"  # Пользователю нужно подождать retry_after секунд
+
+
+class LoadShedder:
+    """Глобальная защита от перебора кодов с множества аккаунтов.
+
+    Промахи считаются в скользящем окне по всем пользователям и по каждому коду. При всплеске
+    бот переходит в защищённый режим: новые пользователи отсекаются сразу, а остальные после
+    каждого промаха ждут всё дольше (base_delay * 2^(промахи - 1), не больше max_delay).
+
+    Время первого появления и последнего попадания пользователей с найденными кодами сохраняется
+    в БД (отложенной записью), поэтому после перезапуска или вытеснения из LRU они не считаются новыми.
+    """
+
+    def __init__(self, enabled: bool = SHED_ENABLED, window: int = SHED_WINDOW,
+                 miss_threshold: int = SHED_MISS_THRESHOLD, miss_ratio: float = SHED_MISS_RATIO,
+                 code_miss_threshold: int = SHED_CODE_MISS_THRESHOLD, cooldown: float = SHED_COOLDOWN,
+                 min_user_age: float = SHED_MIN_USER_AGE, base_delay: float = SHED_BASE_DELAY,
+                 max_delay: float = SHED_MAX_DELAY, max_users: int = SHED_MAX_USERS,
+                 flush_interval: float = SHED_FLUSH_INTERVAL):
+        self.enabled = enabled
+        self.window = window
+        self.miss_threshold = miss_threshold
+        self.miss_ratio = miss_ratio
+        self.code_miss_threshold = code_miss_threshold
+        self.cooldown = cooldown
+        self.min_user_age = min_user_age
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+
+        self._buckets = deque()  # [секунда, поиски, промахи, Counter(код: промахи)]
+        self.lookups = 0  # Поисков в окне
+        self.misses = 0  # Промахов в окне
+        self.code_misses = Counter()  # Промахов по коду в окне
+        self.protected_until = 0.0
+        # user_id: [впервые замечен, последнее попадание, промахи подряд, можно повторить после,
+        #           история из БД уже загружена]
+        self._users = OrderedDict()
+        self._activity = {}  # user_id: (впервые замечен, последнее попадание) по time.time(), ещё не в БД
+
+    def _advance(self, now: float) -> list:
+        """Отбрасывает устаревшие секунды окна и возвращает текущую."""
+        second = int(now)
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            _, lookups, misses, codes = self._buckets.popleft()
+            self.lookups -= lookups
+            self.misses -= misses
+            self.code_misses.subtract(codes)
+            for code in codes:
+                if self.code_misses[code] <= 0:
+                    del self.code_misses[code]
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0, Counter()])
+        return self._buckets[-1]
+
+    def _user(self, user_id: int, now: float) -> list:
+        """Возвращает состояние пользователя; число отслеживаемых пользователей ограничено (LRU)."""
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = [now, None, 0, 0.0, False]
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return user
+
+    def is_protected(self, now: float = None) -> bool:
+        return (now if now is not None else time.monotonic()) < self.protected_until
+
+    def admit(self, user_id: int) -> tuple:
+        """Решает, выполнять ли поиск; возвращает (решение, через сколько секунд можно повторить)."""
+        now = time.monotonic()
+        user = self._user(user_id, now)
+        if not self.enabled or not self.is_protected(now):
+            return ADMIT, 0.0
+
+        if user[1] is None and now - user[0] < self.min_user_age:
+            # Пользователь мог находить коды до перезапуска или вытеснения из LRU
+            self._restore(user_id, user, now)
+        first_seen, last_hit, _, retry_at, _ = user
+        if last_hit is None and now - first_seen < self.min_user_age:
+            metrics.inc("shed_rejected")
+            return REJECT, 0.0
+        if now < retry_at:
+            metrics.inc("shed_delayed")
+            return DELAY, retry_at - now
+        return ADMIT, 0.0
+
+    def record(self, user_id: int, code, hit: bool) -> None:
+        """Учитывает результат поиска (code=None для ввода неверного формата)."""
+        now = time.monotonic()
+        bucket = self._advance(now)
+        user = self._user(user_id, now)
+        bucket[1] += 1
+        self.lookups += 1
+        if hit:
+            user[1] = now
+            user[2] = 0
+            wall = time.time()
+            self._activity[user_id] = (wall - (now - user[0]), wall)
+            return
+
+        bucket[2] += 1
+        self.misses += 1
+        if code is not None:
+            bucket[3][code] += 1
+            self.code_misses[code] += 1
+
+        if self.is_protected(now):
+            user[2] += 1
+            user[3] = now + min(self.max_delay, self.base_delay * 2 ** min(user[2] - 1, 30))
+
+        code_spike = code is not None and self.code_misses[code] >= self.code_miss_threshold
+        global_spike = self.misses >= self.miss_threshold and self.misses >= self.lookups * self.miss_ratio
+        if self.enabled and (code_spike or global_spike):
+            self._protect(now)
+
+    def _restore(self, user_id: int, user: list, now: float) -> None:
+        """Один раз подгружает из БД историю пользователя (только в защищённом режиме, для «новых»)."""
+        if user[4]:
+            return
+        user[4] = True
+        stored = self._activity.get(user_id) or get_user_activity(user_id)
+        if stored is None:
+            return
+        # В БД время по часам системы, в памяти — монотонное
+        offset = now - time.time()
+        user[0] = min(user[0], stored[0] + offset)
+        user[1] = stored[1] + offset
+
+    async def flush(self) -> None:
+        """Сохраняет накопленную историю пользователей в БД одной пачкой."""
+        if not self._activity:
+            return
+        activity, self._activity = self._activity, {}
+        rows = [(user_id, first_seen, last_hit) for user_id, (first_seen, last_hit) in activity.items()]
+        try:
+            await asyncio.to_thread(save_user_activity, rows)
+        except Exception as e:
+            logger.error("Ошибка при сохранении истории пользователей: %s", e)
+            # Возвращаем несохранённое, не затирая более свежие попадания
+            for user_id, value in activity.items():
+                self._activity.setdefault(user_id, value)
+
+    async def run(self) -> None:
+        """Периодически сохраняет историю пользователей в БД."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            # Сохраняем остаток при остановке
+            await self.flush()
+
+    def _protect(self, now: float) -> None:
+        """Включает (или продлевает) защищённый режим на cooldown секунд."""
+        if not self.is_protected(now):
+            logger.warning(
+                "Включён защищённый режим: промахов за %s с — %s из %s поисков",
+                self.window, self.misses, self.lookups
+            )
+            metrics.inc("shed_activations")
+        self.protected_until = now + self.cooldown
+        metrics.set_gauge(
+            "shed_protected_until", (datetime.now() + timedelta(seconds=self.cooldown)).strftime("%Y-%m-%d %H:%M:%S")
+        )
+
+
+# Глобальный экземпляр
+load_shedder = LoadShedder()
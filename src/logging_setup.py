@@ -0,0 +1,131 @@
+import sys
+import time
+import queue
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+from config import (
+    LOG_LEVEL, LOG_LEVELS, LOG_RATE_LIMIT_WINDOW, LOG_RATE_LIMIT_BURST
+)
+
+# Структурированные поля, которые добавляются к каждой записи, если заданы
+STRUCTURED_FIELDS = ("update_id", "user_id", "code", "duration_ms")
+
+# Идентификатор обрабатываемого обновления (проставляется middleware для каждой задачи)
+current_update_id = contextvars.ContextVar("current_update_id", default=None)
+current_user_id = contextvars.ContextVar("current_user_id", default=None)
+
+# Максимум различных сообщений, для которых отслеживаются повторы
+RATE_LIMIT_MAX_KEYS = 10000
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись update_id и user_id текущего обновления."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "update_id", None) is None:
+            record.update_id = current_update_id.get()
+        if getattr(record, "user_id", None) is None:
+            record.user_id = current_user_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Пропускает не более burst одинаковых сообщений за окно, остальные считает и отбрасывает."""
+
+    def __init__(self, window: float = LOG_RATE_LIMIT_WINDOW, burst: int = LOG_RATE_LIMIT_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._seen = {}  # key: [window_start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                suppressed = entry[2] if entry else 0
+                if len(self._seen) >= RATE_LIMIT_MAX_KEYS:
+                    self._seen.clear()
+                self._seen[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            return False
+
+
+class StructuredFormatter(logging.Formatter):
+    """Формирует строку лога и дописывает к ней структурированные поля key=value."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        text = super().formatMessage(record)
+        fields = [
+            f"{name}={getattr(record, name)}" for name in STRUCTURED_FIELDS
+            if getattr(record, name, None) is not None
+        ]
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            fields.append(f"suppressed_repeats={suppressed}")
+        return f"{text} | {' '.join(fields)}" if fields else text
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Кладёт запись в очередь как есть: форматирование выполняется в фоновом потоке."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_levels(spec: str) -> dict:
+    """Разбирает строку вида "dp_manager=WARNING,aiogram=INFO" в словарь уровней."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging() -> None:
+    """Настраивает неблокирующее логирование: обработчики только ставят записи в очередь."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(StructuredFormatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Останавливает фоновый поток, предварительно записав все записи из очереди."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
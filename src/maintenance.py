@@ -0,0 +1,141 @@
+import time
+import random
+import asyncio
+import logging
+from datetime import timedelta
+
+from config import (
+    ALL_DATABASE_PATHS, MAINTENANCE_CHECKPOINT_INTERVAL, MAINTENANCE_OPTIMIZE_INTERVAL,
+    MAINTENANCE_VACUUM_INTERVAL, MAINTENANCE_VACUUM_PAGES, MAINTENANCE_EXPIRY_INTERVAL,
+    MAINTENANCE_JITTER, MAINTENANCE_MAX_LOOKUP_P95, MAINTENANCE_RETRY_DELAY, MODERATION_STATE_TTL,
+    IDEMPOTENCY_KEY_TTL
+)
+from metrics import metrics
+from dp_manager import (
+    checkpoint_wal, optimize_database, incremental_vacuum, purge_idempotency_keys, using_database
+)
+from utils import moderation
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceJob:
+    """Периодическая задача обслуживания."""
+
+    def __init__(self, name: str, func, interval: float):
+        self.name = name
+        self.func = func  # Асинхронная функция без аргументов
+        self.interval = interval
+        self.next_run = 0.0
+
+
+class MaintenanceScheduler:
+    """Запускает задачи обслуживания с разбросом интервалов, откладывая их при медленном поиске кодов."""
+
+    def __init__(self, jitter: float = MAINTENANCE_JITTER, max_lookup_p95: float = MAINTENANCE_MAX_LOOKUP_P95,
+                 retry_delay: float = MAINTENANCE_RETRY_DELAY):
+        self.jitter = jitter
+        self.max_lookup_p95 = max_lookup_p95
+        self.retry_delay = retry_delay
+        self.jobs = []
+        self._lookup_count = 0
+
+    def add_job(self, name: str, func, interval: float) -> None:
+        job = MaintenanceJob(name, func, interval)
+        # Первый запуск тоже со случайным сдвигом, чтобы задачи не стартовали одновременно
+        job.next_run = time.monotonic() + self._jittered(interval)
+        self.jobs.append(job)
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _is_busy(self) -> bool:
+        """Идёт резервное копирование или поиск кодов сейчас медленнее порога."""
+        if metrics.get_gauge("backup_in_progress"):
+            return True
+        # Окно замеров не стареет, поэтому смотрим на него, только если с прошлой проверки были поиски
+        count = metrics.timing_counts.get("lookup_latency", 0)
+        fresh = count != self._lookup_count
+        self._lookup_count = count
+        return fresh and metrics.summary("lookup_latency")["p95"] > self.max_lookup_p95
+
+    async def run_job(self, job: MaintenanceJob) -> None:
+        try:
+            with metrics.timer(f"maintenance_{job.name}"):
+                await job.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.inc(f"maintenance_{job.name}_errors")
+            logger.error("Ошибка в задаче обслуживания %s: %s", job.name, e)
+
+    async def run(self) -> None:
+        """Основной цикл: ждёт ближайшую задачу и выполняет её, если бот не под нагрузкой."""
+        while True:
+            job = min(self.jobs, key=lambda item: item.next_run)
+            await asyncio.sleep(max(0.0, job.next_run - time.monotonic()))
+            if self._is_busy():
+                metrics.inc("maintenance_skipped")
+                logger.debug("Обслуживание %s отложено: поиск кодов замедлен", job.name)
+                job.next_run = time.monotonic() + self.retry_delay
+                continue
+            await self.run_job(job)
+            job.next_run = time.monotonic() + self._jittered(job.interval)
+
+
+async def _for_each_database(func, *args) -> list:
+    """Выполняет функцию dp_manager в отдельном потоке для каждой базы контактов."""
+    results = []
+    for database_path in ALL_DATABASE_PATHS:
+        with using_database(database_path):
+            results.append(await asyncio.to_thread(func, *args))
+    return results
+
+
+async def checkpoint_job() -> None:
+    await _for_each_database(checkpoint_wal)
+
+
+async def optimize_job() -> None:
+    await _for_each_database(optimize_database)
+
+
+async def vacuum_job() -> None:
+    freed = sum(await _for_each_database(incremental_vacuum, MAINTENANCE_VACUUM_PAGES))
+    if freed:
+        logger.info("Инкрементальный VACUUM освободил страниц: %s", freed)
+
+
+async def purge_keys_job() -> None:
+    await _for_each_database(purge_idempotency_keys, IDEMPOTENCY_KEY_TTL)
+
+
+def sweep_fsm_storage(storage) -> int:
+    """Удаляет из MemoryStorage пустые записи (без состояния и данных), которые копятся по одной на чат."""
+    records = getattr(storage, "storage", None)
+    if records is None:
+        return 0
+    empty = [key for key, record in records.items() if record.state is None and not record.data]
+    for key in empty:
+        del records[key]
+    return len(empty)
+
+
+def create_maintenance_scheduler(storage) -> MaintenanceScheduler:
+    """Создаёт планировщик со стандартными задачами обслуживания."""
+    scheduler = MaintenanceScheduler()
+
+    async def expiry_job() -> None:
+        # Выполняется в потоке цикла событий: словари используются обработчиками без блокировок
+        swept = moderation.sweep(timedelta(seconds=MODERATION_STATE_TTL))
+        swept_fsm = sweep_fsm_storage(storage)
+        metrics.set_gauge("moderation_entries", len(moderation.muted_users))
+        if swept or swept_fsm:
+            logger.info("Очищено записей: модерация %s, FSM %s", swept, swept_fsm)
+
+    scheduler.add_job("checkpoint", checkpoint_job, MAINTENANCE_CHECKPOINT_INTERVAL)
+    scheduler.add_job("optimize", optimize_job, MAINTENANCE_OPTIMIZE_INTERVAL)
+    scheduler.add_job("vacuum", vacuum_job, MAINTENANCE_VACUUM_INTERVAL)
+    scheduler.add_job("expiry", expiry_job, MAINTENANCE_EXPIRY_INTERVAL)
+    scheduler.add_job("purge_keys", purge_keys_job, MAINTENANCE_EXPIRY_INTERVAL)
+    return scheduler
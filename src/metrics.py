@@ -0,0 +1,74 @@
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Сколько последних замеров хранить для расчёта перцентилей
+TIMING_WINDOW = 1000
+
+
+class Metrics:
+    """Простые метрики процесса: счётчики, значения-датчики и длительности операций."""
+
+    def __init__(self, window: int = TIMING_WINDOW):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.timings = defaultdict(lambda: deque(maxlen=window))
+        self.timing_counts = defaultdict(int)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        """Увеличивает счётчик."""
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value) -> None:
+        """Устанавливает текущее значение датчика."""
+        self.gauges[name] = value
+
+    def get_gauge(self, name: str, default=0):
+        """Возвращает текущее значение датчика."""
+        return self.gauges.get(name, default)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Сохраняет длительность операции в секундах."""
+        self.timings[name].append(seconds)
+        self.timing_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        """Контекстный менеджер для замера длительности блока кода."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def summary(self, name: str) -> dict:
+        """Возвращает количество, среднее, p50, p95 и максимум по последним замерам."""
+        values = sorted(self.timings.get(name, ()))
+        if not values:
+            return {"count": self.timing_counts.get(name, 0), "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": self.timing_counts[name],
+            "avg": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+
+    def format_report(self) -> str:
+        """Формирует текстовый отчёт по всем метрикам."""
+        lines = []
+        for name in sorted(self.counters):
+            lines.append(f"{name}: {self.counters[name]}")
+        for name in sorted(self.gauges):
+            lines.append(f"{name}: {self.gauges[name]}")
+        for name in sorted(self.timings):
+            s = self.summary(name)
+            lines.append(
+                f"{name}: n={s['count']} avg={s['avg'] * 1000:.1f}мс "
+                f"p50={s['p50'] * 1000:.1f}мс p95={s['p95'] * 1000:.1f}мс max={s['max'] * 1000:.1f}мс"
+            )
+        return "\n".join(lines) if lines else "Метрик пока нет."
+
+
+# Создаем глобальный экземпляр метрик
+metrics = Metrics()
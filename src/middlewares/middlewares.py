@@ -0,0 +1,63 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logging_setup import current_update_id, current_user_id
+from dp_manager import current_database_path
+from acl import access_control
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Проставляет update_id и user_id обновления в контекст логирования."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = current_update_id.set(event.update_id)
+        user_token = current_user_id.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_update_id.reset(update_token)
+            current_user_id.reset(user_token)
+
+
+class DatabaseContextMiddleware(BaseMiddleware):
+    """Переключает работу с контактами на базу бота, получившего обновление."""
+
+    def __init__(self, database_paths: Dict[int, str]):
+        self.database_paths = database_paths  # bot_id: путь к базе контактов
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = current_database_path.set(self.database_paths.get(data["bot"].id))
+        try:
+            return await handler(event, data)
+        finally:
+            current_database_path.reset(token)
+
+
+class RoleMiddleware(BaseMiddleware):
+    """Передаёт обработчикам и фильтрам роль отправителя (role: admin, moderator или None).
+
+    Должен подключаться после DatabaseContextMiddleware: роли хранятся в базе контактов бота.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        data["role"] = access_control.get_role(user.id) if user else None
+        return await handler(event, data)
@@ -0,0 +1,64 @@
+import os
+import asyncio
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import FSInputFile
+
+from config import (
+    TELEGRAM_API_SERVER, TELEGRAM_API_LOCAL,
+    TELEGRAM_API_SERVER_FILES_DIR, TELEGRAM_API_LOCAL_FILES_DIR
+)
+
+
+def create_bot_session() -> AiohttpSession:
+    """Создаёт HTTP-сессию (общий пул соединений для всех ботов процесса)."""
+    if not TELEGRAM_API_SERVER:
+        return AiohttpSession()
+    api = TelegramAPIServer.from_base(TELEGRAM_API_SERVER, is_local=TELEGRAM_API_LOCAL)
+    return AiohttpSession(api=api)
+
+
+def local_input_file(path: str):
+    """Возвращает файл для отправки: путь на локальном сервере вместо multipart-загрузки.
+
+    Файл вне общего с сервером каталога (TELEGRAM_API_LOCAL_FILES_DIR) загружается как обычно.
+    """
+    if TELEGRAM_API_LOCAL:
+        server_path = _map_local_path(path)
+        if server_path is not None:
+            return f"file://{server_path}"
+    return FSInputFile(path)
+
+
+def _map_local_path(path: str):
+    """Переводит путь этого процесса в путь, по которому файл видит сервер Bot API (None — сервер его не видит)."""
+    path = os.path.abspath(path)
+    if TELEGRAM_API_SERVER_FILES_DIR and TELEGRAM_API_LOCAL_FILES_DIR:
+        relative = os.path.relpath(path, os.path.abspath(TELEGRAM_API_LOCAL_FILES_DIR))
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return os.path.join(TELEGRAM_API_SERVER_FILES_DIR, relative)
+    return path
+
+
+def _map_server_path(file_path: str) -> str:
+    """Переводит путь в каталоге сервера Bot API в путь, доступный этому процессу (обратно _map_local_path)."""
+    if TELEGRAM_API_SERVER_FILES_DIR and TELEGRAM_API_LOCAL_FILES_DIR:
+        relative = os.path.relpath(file_path, TELEGRAM_API_SERVER_FILES_DIR)
+        return os.path.join(TELEGRAM_API_LOCAL_FILES_DIR, relative)
+    return file_path
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+async def download_telegram_file(bot: Bot, file_path: str) -> bytes:
+    """Скачивает файл: с локального сервера читаем напрямую с диска, иначе через API."""
+    if TELEGRAM_API_LOCAL and os.path.isabs(file_path):
+        return await asyncio.to_thread(_read_file, _map_server_path(file_path))
+    downloaded = await bot.download_file(file_path)
+    return downloaded.read()
@@ -0,0 +1,25 @@
+from codes import CODE_FORMAT_HINT
+
+# Статические тексты ответов собираются один раз при импорте
+
+START_TEXT = (
+    "👋 Добро пожаловать!\n\n"
+    "🔍 Для поиска информации используйте кнопку «Ввести код»\n"
+    "❓ Если у вас возникли вопросы, нажмите «Помощь»"
+)
+
+HELP_TEXT = f"""
+ℹ️ Помощь по использованию бота:
+
+1️⃣ Для поиска информации нажмите кнопку «Ввести код» и введите код ({CODE_FORMAT_HINT})
+2️⃣ После ввода кода вы получите всю доступную информацию
+3️⃣ Если у вас возникли вопросы или проблемы, воспользуйтесь кнопкой связи с поддержкой 👇
+"""
+
+ENTER_CODE_TEXT = f"🔢 Введите код ({CODE_FORMAT_HINT}):"
+
+INVALID_CODE_TEXT = f"❌ Некорректный формат кода. Код должен состоять из {CODE_FORMAT_HINT}."
+
+CHOOSE_ACTION_TEXT = "Выберите действие:"
+
+UNKNOWN_MESSAGE_TEXT = "❓ Пожалуйста, используйте доступные команды из меню:"
@@ -0,0 +1,265 @@
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from collections import deque, OrderedDict
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+from config import (
+    UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, POLLING_TIMEOUT, UPDATE_DEDUP_SIZE, UPDATE_DEDUP_TTL,
+    SHUTDOWN_CRITICAL_TIMEOUT
+)
+from metrics import metrics
+from dp_manager import (
+    get_polling_offset, save_polling_offset, save_pending_updates, take_pending_updates,
+    save_fsm_states, take_fsm_states
+)
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторным запросом getUpdates после ошибки сети, сек (растёт до максимума)
+POLLING_RETRY_DELAY = 1
+POLLING_MAX_RETRY_DELAY = 30
+
+# (bot_id, update_id) обновления, которое обрабатывается в текущей задаче
+_current_update = contextvars.ContextVar("current_update", default=None)
+# Выполняющиеся защищённые секции: задача -> (bot_id, update_id)
+_critical_sections = {}
+
+
+async def shielded(coro):
+    """Выполняет секцию обработчика так, что остановка бота не прерывает её посередине.
+
+    Отменённый при остановке обработчик перестаёт ждать, а секцию дорабатывает drain;
+    обновление, чья секция завершилась, повторно не обрабатывается.
+    """
+    task = asyncio.create_task(coro)
+    _critical_sections[task] = _current_update.get()
+    task.add_done_callback(lambda done: _critical_sections.pop(done, None))
+    return await asyncio.shield(task)
+
+
+def get_chat_key(update: Update):
+    """Возвращает ключ очереди обновления: чат, а если его нет — пользователь."""
+    message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+    if message is not None:
+        return ("chat", message.chat.id)
+    if update.callback_query is not None:
+        callback = update.callback_query
+        if callback.message is not None:
+            return ("chat", callback.message.chat.id)
+        return ("user", callback.from_user.id)
+    for event in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query, update.my_chat_member, update.chat_member,
+                  update.chat_join_request):
+        if event is not None:
+            chat = getattr(event, "chat", None)
+            if chat is not None:
+                return ("chat", chat.id)
+            return ("user", event.from_user.id)
+    return None
+
+
+class SeenUpdates:
+    """Недавно принятые обновления: не больше max_size записей и не дольше ttl секунд."""
+
+    def __init__(self, max_size: int = UPDATE_DEDUP_SIZE, ttl: float = UPDATE_DEDUP_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen = OrderedDict()  # (bot_id, update_id): время приёма, от старых к новым
+
+    def add(self, key) -> bool:
+        """Запоминает ключ; возвращает False, если он уже встречался."""
+        now = time.monotonic()
+        # Записи упорядочены по времени, поэтому устаревшие всегда в начале
+        while self._seen and next(iter(self._seen.values())) <= now - self.ttl:
+            self._seen.popitem(last=False)
+        if key in self._seen:
+            return False
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return True
+
+
+class UpdateScheduler:
+    """Параллельная обработка обновлений: разные чаты — одновременно, один чат — строго по порядку."""
+
+    def __init__(self, dispatcher: Dispatcher, max_concurrency: int = UPDATE_CONCURRENCY,
+                 max_pending: int = UPDATE_MAX_PENDING):
+        self.dispatcher = dispatcher
+        self._workers = asyncio.Semaphore(max_concurrency)
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._chains = {}  # chat_key: deque[(bot, update, enqueued_at)]
+        self._tasks = set()
+        self._items = {}  # (bot_id, update_id): (bot, update) — принятые, но ещё не обработанные
+        self._seen = SeenUpdates()
+        self.pending = 0
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _set_pending(self, delta: int) -> None:
+        self.pending += delta
+        metrics.set_gauge("update_queue_depth", self.pending)
+
+    async def submit(self, bot: Bot, update: Update) -> None:
+        """Ставит обновление в очередь; ждёт, если достигнут лимит необработанных обновлений.
+
+        Повторно доставленные обновления отбрасываются до очереди, обработчиков и хранилища FSM.
+        """
+        if not self._seen.add((bot.id, update.update_id)):
+            metrics.inc("duplicate_updates")
+            logger.debug("Повторное обновление отброшено", extra={"update_id": update.update_id})
+            return
+        started = time.perf_counter()
+        await self._capacity.acquire()
+        metrics.observe("update_backpressure_wait", time.perf_counter() - started)
+        self._set_pending(1)
+
+        item = (bot, update, time.perf_counter())
+        self._items[(bot.id, update.update_id)] = (bot, update)
+        key = get_chat_key(update)
+        if key is None:
+            self._spawn(self._run_one(item))
+            return
+
+        # Одни и те же чаты разных ботов независимы
+        key = (bot.id, key)
+        chain = self._chains.get(key)
+        if chain is not None:
+            # Для чата уже идёт обработка — обновление выполнится после предыдущих
+            chain.append(item)
+            return
+        self._chains[key] = deque([item])
+        self._spawn(self._run_chain(key))
+
+    async def _run_chain(self, key) -> None:
+        """Последовательно обрабатывает очередь одного чата."""
+        chain = self._chains[key]
+        try:
+            while chain:
+                # Элемент остаётся в очереди до завершения, чтобы новые обновления вставали за ним
+                await self._run_one(chain[0])
+                chain.popleft()
+        finally:
+            del self._chains[key]
+
+    async def _run_one(self, item) -> None:
+        bot, update, enqueued_at = item
+        try:
+            async with self._workers:
+                _current_update.set((bot.id, update.update_id))
+                metrics.observe("update_wait_time", time.perf_counter() - enqueued_at)
+                with metrics.timer("update_handle_time"):
+                    await self.dispatcher.feed_update(bot, update)
+        except Exception as e:
+            logger.error("Ошибка при обработке обновления: %s", e, extra={"update_id": update.update_id})
+        finally:
+            self._items.pop((bot.id, update.update_id), None)
+            self._set_pending(-1)
+            self._capacity.release()
+
+    async def drain(self, timeout: float, critical_timeout: float = SHUTDOWN_CRITICAL_TIMEOUT) -> int:
+        """Ждёт обработки принятых обновлений; не успевшие за timeout отменяет и сохраняет в БД.
+
+        Начатые защищённые секции (shielded) отмена не прерывает: их ждём ещё critical_timeout
+        секунд, и обновления с завершённой секцией не сохраняются. Возвращает количество сохранённых обновлений.
+        """
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+        # Снимок и отмена без await между ними: задачи не успеют завершиться после снимка
+        leftovers = dict(self._items)
+        critical = dict(_critical_sections)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if critical:
+            done, running = await asyncio.wait(critical, timeout=critical_timeout)
+            for task in done:
+                leftovers.pop(critical[task], None)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        if not leftovers:
+            return 0
+
+        rows = [(bot.id, update.update_id, update.json(exclude_none=True)) for bot, update in leftovers.values()]
+        await asyncio.to_thread(save_pending_updates, rows)
+        logger.warning("Не обработано до остановки обновлений: %s (будут обработаны после запуска)", len(rows))
+        return len(rows)
+
+    async def replay_pending(self, bot: Bot) -> int:
+        """Ставит в очередь обновления, сохранённые при прошлой остановке."""
+        rows = await asyncio.to_thread(take_pending_updates, bot.id)
+        for update_id, payload in rows:
+            await self.submit(bot, Update(**json.loads(payload)))
+        if rows:
+            logger.info("Повторно поставлено в очередь обновлений после перезапуска: %s", len(rows))
+        return len(rows)
+
+
+async def persist_fsm_storage(storage) -> int:
+    """Сохраняет непустые записи MemoryStorage, чтобы после перезапуска сценарии продолжились."""
+    rows = [
+        (key.bot_id, key.chat_id, key.user_id, key.destiny, record.state, json.dumps(record.data, ensure_ascii=False))
+        for key, record in storage.storage.items()
+        if record.state is not None or record.data
+    ]
+    await asyncio.to_thread(save_fsm_states, rows)
+    return len(rows)
+
+
+async def restore_fsm_storage(storage) -> int:
+    """Загружает в MemoryStorage состояния, сохранённые при прошлой остановке (до replay_pending)."""
+    rows = await asyncio.to_thread(take_fsm_states)
+    for bot_id, chat_id, user_id, destiny, state, data in rows:
+        record = storage.storage[StorageKey(bot_id=bot_id, chat_id=chat_id, user_id=user_id, destiny=destiny)]
+        record.state = state
+        record.data = json.loads(data)
+    if rows:
+        logger.info("Восстановлено состояний FSM после перезапуска: %s", len(rows))
+    return len(rows)
+
+
+async def run_polling(bot: Bot, dispatcher: Dispatcher, scheduler: UpdateScheduler) -> None:
+    """Получает обновления через getUpdates и передаёт их планировщику.
+
+    Сдвиг сохраняется в БД при остановке (отмене задачи), и новый процесс продолжает с него.
+    """
+    allowed_updates = dispatcher.resolve_used_update_types()
+    offset = await asyncio.to_thread(get_polling_offset, bot.id)
+    retry_delay = POLLING_RETRY_DELAY
+    logger.info("Запуск получения обновлений")
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка при получении обновлений: %s", e)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, POLLING_MAX_RETRY_DELAY)
+                continue
+
+            retry_delay = POLLING_RETRY_DELAY
+            for update in updates:
+                # submit ждёт при заполненной очереди, поэтому следующий getUpdates откладывается
+                await scheduler.submit(bot, update)
+                # Сдвиг растёт только после постановки в очередь: при остановке посреди пачки
+                # оставшиеся обновления не подтверждаются и придут новому процессу
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            save_polling_offset(bot.id, offset)
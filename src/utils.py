@@ -1,10 +1,17 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
-from config import IMAGES_PATH, TEMP_IMAGES_PATH
+import logging
+from config import IMAGES_PATH, TEMP_IMAGES_PATH, render_images_dir
+from dp_manager import get_database_path
 
 # Путь к стандартному шрифту, если нужно использовать пользовательский
 DEFAULT_FONT_PATH = "arial.ttf"
 
+# Максимальная доля ширины изображения, которую может занимать код
+MAX_TEXT_WIDTH_RATIO = 0.9
+
+logger = logging.getLogger(__name__)
+
 def add_code_to_image(code, background_path, output_path):
     """
     Добавляет текстовый код на фоновое изображение и сохраняет результат.
@@ -30,7 +37,7 @@ def add_code_to_image(code, background_path, output_path):
         font_size = 500  # Размер шрифта для текста (измените этот параметр для изменения размера текста)
         font = ImageFont.truetype(DEFAULT_FONT_PATH, size=font_size)
     except IOError:
-        print(f"Пользовательский шрифт не найден. Используется стандартный шрифт.")
+        logger.warning("Пользовательский шрифт не найден. Используется стандартный шрифт.")
         font = ImageFont.load_default()
 
     # Создаем объект для рисования текста
@@ -40,6 +47,13 @@ def add_code_to_image(code, background_path, output_path):
     text_bbox = draw.textbbox((0, 0), code, font=font)
     text_width, text_height = text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1]
 
+    # Длинные коды уменьшаем, чтобы текст занимал не больше MAX_TEXT_WIDTH_RATIO ширины
+    max_text_width = width * MAX_TEXT_WIDTH_RATIO
+    if text_width > max_text_width and isinstance(font, ImageFont.FreeTypeFont):
+        font = font.font_variant(size=max(1, int(font.size * max_text_width / text_width)))
+        text_bbox = draw.textbbox((0, 0), code, font=font)
+        text_width, text_height = text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1]
+
     # Координаты для размещения текста по центру
     position = ((width - text_width) // 2, (height - text_height) // 2)
 
@@ -52,9 +66,9 @@ def add_code_to_image(code, background_path, output_path):
     # Сохраняем изображение
     try:
         background.save(output_path)
-        print(f"Изображение с кодом сохранено в: {output_path}")
+        logger.debug("Изображение с кодом сохранено в: %s", output_path, extra={"code": code})
     except IOError as e:
-        print(f"Ошибка при сохранении изображения: {e}")
+        logger.error("Ошибка при сохранении изображения: %s", e, extra={"code": code})
         return None
 
     return output_path
@@ -66,9 +80,9 @@ def process_photo_with_code(code):
     :param code: Код для добавления на изображение.
     :return: Путь к сгенерированному изображению.
     """
-    # Пути к файлам в папке temp
+    # Пути к файлам в папке temp; изображение кладётся в папку базы контактов текущего бота
     background_path = os.path.join(TEMP_IMAGES_PATH, "user_images", "stock_image.png")
-    output_path = os.path.join(TEMP_IMAGES_PATH, "user_images", f"stock_image_with_code_{code}.png")
+    output_path = os.path.join(render_images_dir(get_database_path()), f"stock_image_with_code_{code}.png")
 
     # Преобразуем пути в абсолютные
     background_path = os.path.abspath(background_path)
@@ -83,15 +97,16 @@ from datetime import datetime, timedelta
 # Система модерации
 class ModerationSystem:
     def __init__(self):
-        self.muted_users = {}  # user_id: {attempts: int, muted_until: datetime, mute_count: int}
+        self.muted_users = {}  # user_id: {attempts: int, muted_until: datetime, mute_count: int, last_seen: datetime}
         self.MAX_ATTEMPTS = 5
 
     def increment_attempts(self, user_id: int) -> tuple[bool, int]:
         """Увеличивает счетчик неудачных попыток и возвращает (нужно_ли_мутить, осталось_попыток)"""
         if user_id not in self.muted_users:
-            self.muted_users[user_id] = {"attempts": 1, "muted_until": None, "mute_count": 0}
+            self.muted_users[user_id] = {"attempts": 1, "muted_until": None, "mute_count": 0, "last_seen": datetime.now()}
             return False, self.MAX_ATTEMPTS - 1
         
+        self.muted_users[user_id]["last_seen"] = datetime.now()
         if not self.is_muted(user_id):
             self.muted_users[user_id]["attempts"] += 1
             attempts = self.muted_users[user_id]["attempts"]
@@ -113,7 +128,8 @@ class ModerationSystem:
         self.muted_users[user_id] = {
             "attempts": 0,
             "muted_until": muted_until,
-            "mute_count": user_data["mute_count"]
+            "mute_count": user_data["mute_count"],
+            "last_seen": datetime.now()
         }
         
         return {
@@ -166,5 +182,16 @@ class ModerationSystem:
         
         return muted_list
 
+    def sweep(self, max_idle: timedelta) -> int:
+        """Удаляет записи пользователей без активного мута, не появлявшихся дольше max_idle"""
+        deadline = datetime.now() - max_idle
+        stale = [
+            user_id for user_id, data in self.muted_users.items()
+            if data.get("last_seen", deadline) <= deadline and not self.is_muted(user_id)
+        ]
+        for user_id in stale:
+            del self.muted_users[user_id]
+        return len(stale)
+
 # Создаем глобальный экземпляр системы модерации
 moderation = ModerationSystem()
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""Минимальная замена локального сервера Bot API (telegram-bot-api --local) для тестов.
+
+Сервер видит файлы только внутри своего каталога server_dir, как контейнер с примонтированным
+томом: file:// пути вне него отклоняются так же, как настоящий сервер отвечает «file not found».
+Поддерживаются методы getMe, getFile и sendPhoto.
+"""
+import json
+import os
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class LocalBotAPIServer:
+    """Запускает сервер в фоновом потоке на свободном порту (используется как контекстный менеджер)."""
+
+    def __init__(self, server_dir: str):
+        self.server_dir = os.path.abspath(server_dir)
+        self.files = {}  # file_id: путь к файлу на стороне сервера
+        self.uploaded = []  # Пути file://, принятые sendPhoto
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def add_file(self, file_id: str, server_path: str) -> None:
+        """Регистрирует файл, который getFile вернёт по file_id (как файл, полученный от пользователя)."""
+        self.files[file_id] = server_path
+
+    def _resolve(self, value: str):
+        """Возвращает путь из file:// URI, если сервер видит этот файл."""
+        if not value.startswith("file://"):
+            return None
+        path = os.path.abspath(value[len("file://"):])
+        if os.path.commonpath([path, self.server_dir]) != self.server_dir or not os.path.isfile(path):
+            return None
+        return path
+
+    def call(self, method: str, params: dict):
+        """Выполняет метод API; возвращает (HTTP-статус, ответ)."""
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Stand-in"}}
+        if method == "getFile":
+            path = self.files.get(params.get("file_id"))
+            if path is None:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            return 200, {"ok": True, "result": {
+                "file_id": params["file_id"], "file_unique_id": params["file_id"],
+                "file_size": os.path.getsize(path), "file_path": path
+            }}
+        if method == "sendPhoto":
+            path = self._resolve(params.get("photo", ""))
+            if path is None:
+                return 400, {"ok": False, "error_code": 400, "description": "Bad Request: file not found"}
+            self.uploaded.append(path)
+            return 200, {"ok": True, "result": {
+                "message_id": len(self.uploaded), "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "photo": [{"file_id": f"photo-{len(self.uploaded)}", "file_unique_id": f"u{len(self.uploaded)}",
+                           "width": 1, "height": 1}]
+            }}
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, response = server.call(self.path.rsplit("/", 1)[-1], _parse_params(self.headers, body))
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _parse_params(headers, body: bytes) -> dict:
+    """Разбирает параметры запроса: multipart/form-data, urlencoded или JSON."""
+    content_type = headers.get("Content-Type", "")
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        return {
+            part.get_param("name", header="content-disposition"): part.get_content()
+            for part in message.iter_parts()
+        }
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return dict(parse_qsl(body.decode()))
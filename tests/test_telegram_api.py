@@ -0,0 +1,92 @@
+"""Отправка и скачивание файлов через локальный сервер Bot API с разными путями к общему каталогу."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+pytest.importorskip("aiogram")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.exceptions import TelegramBadRequest  # noqa: E402
+from aiogram.types import FSInputFile  # noqa: E402
+
+import telegram_api  # noqa: E402
+from local_bot_api import LocalBotAPIServer  # noqa: E402
+
+TOKEN = "123456:TEST"
+
+
+@pytest.fixture
+def shared_dirs(tmp_path, monkeypatch):
+    """Один каталог под двумя путями: как его видит бот и как его видит сервер (том контейнера)."""
+    local_dir = tmp_path / "bot-view"
+    local_dir.mkdir()
+    server_dir = tmp_path / "server-view"
+    server_dir.symlink_to(local_dir, target_is_directory=True)
+    monkeypatch.setattr(telegram_api, "TELEGRAM_API_LOCAL", True)
+    monkeypatch.setattr(telegram_api, "TELEGRAM_API_LOCAL_FILES_DIR", str(local_dir))
+    monkeypatch.setattr(telegram_api, "TELEGRAM_API_SERVER_FILES_DIR", str(server_dir))
+    return local_dir, server_dir
+
+
+def run_with_bot(server: LocalBotAPIServer, func):
+    async def main():
+        api = TelegramAPIServer.from_base(server.url, is_local=True)
+        bot = Bot(token=TOKEN, session=AiohttpSession(api=api))
+        try:
+            return await func(bot)
+        finally:
+            await bot.session.close()
+    return asyncio.run(main())
+
+
+def test_upload_uses_server_path(shared_dirs):
+    local_dir, server_dir = shared_dirs
+    image = local_dir / "stock_image_with_code_000123.png"
+    image.write_bytes(b"png")
+
+    photo = telegram_api.local_input_file(str(image))
+    assert photo == f"file://{server_dir / image.name}"
+
+    with LocalBotAPIServer(str(server_dir)) as server:
+        message = run_with_bot(server, lambda bot: bot.send_photo(42, photo))
+        assert message.photo[-1].file_id == "photo-1"
+        assert server.uploaded == [str(server_dir / image.name)]
+
+        # Путь со стороны бота сервер не видит
+        with pytest.raises(TelegramBadRequest):
+            run_with_bot(server, lambda bot: bot.send_photo(42, f"file://{image}"))
+
+
+def test_upload_outside_shared_dir_falls_back_to_multipart(shared_dirs, tmp_path):
+    image = tmp_path / "elsewhere.png"
+    image.write_bytes(b"png")
+    assert isinstance(telegram_api.local_input_file(str(image)), FSInputFile)
+
+
+def test_download_reads_mapped_local_path(shared_dirs):
+    local_dir, server_dir = shared_dirs
+    (local_dir / "photos").mkdir()
+    (local_dir / "photos" / "file_1.jpg").write_bytes(b"image bytes")
+
+    with LocalBotAPIServer(str(server_dir)) as server:
+        server.add_file("photo-file", str(server_dir / "photos" / "file_1.jpg"))
+
+        async def download(bot):
+            file = await bot.get_file("photo-file")
+            assert file.file_path == str(server_dir / "photos" / "file_1.jpg")
+            return await telegram_api.download_telegram_file(bot, file.file_path)
+
+        assert run_with_bot(server, download) == b"image bytes"
+
+
+def test_download_without_shared_dir_mapping_reads_path_as_is(shared_dirs, monkeypatch):
+    local_dir, _ = shared_dirs
+    monkeypatch.setattr(telegram_api, "TELEGRAM_API_SERVER_FILES_DIR", "")
+    (local_dir / "doc.bin").write_bytes(b"data")
+    assert asyncio.run(telegram_api.download_telegram_file(None, str(local_dir / "doc.bin"))) == b"data"